@@ -0,0 +1,229 @@
+"""
+Check the background job queue against the offline Earth Engine stand-in.
+
+Drives utils.jobs.JobQueue with utils.extraction.extract_points, the
+sampling step of the page 3 extraction jobs, and benchmarks/fake_ee.py as
+the backend, so no Earth Engine account or network access is needed. Each
+case checks one behaviour the page relies on:
+
+    dedupe       jobs submitted with the same key share one run and its requests
+    failure      an error in the job is kept as a failed status, and the key
+                 can be submitted again
+    expiry       finished jobs are dropped after the ttl, and their key runs again
+    concurrency  jobs beyond the worker count wait in the queue
+
+The script exits with status 1 when a check fails.
+
+Usage:
+    python benchmarks/bench_jobs.py
+    python benchmarks/bench_jobs.py --points 20000 --latency 0.2 --workers 2 --output results.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_extraction import synthetic_points
+from benchmarks.fake_ee import FakeEarthEngine, FakeImage
+
+
+def upload_points(n_points, seed):
+    """Synthetic plots shaped like utils.ingest.read_points output."""
+    gdf = synthetic_points(n_points, seed=seed)
+    return pd.DataFrame(gdf[["LAT", "LON", "plot_ID"]])
+
+
+def wait(queue, job_id, timeout=60.0):
+    """Poll a job like the page does until it finishes, and return its status."""
+    from utils.jobs import DONE, FAILED
+
+    deadline = time.monotonic() + timeout
+    while True:
+        job = queue.status(job_id)
+        if job is None or job["status"] in (DONE, FAILED):
+            return job
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Job {job_id} still {job['status']} after {timeout} s")
+        time.sleep(0.01)
+
+
+def correct(result, points, image):
+    """Whether a job result has plot_ID first and the values of every point."""
+    return bool(
+        result is not None
+        and result.columns[0] == "plot_ID"
+        and np.array_equal(result["plot_ID"].to_numpy(), points["plot_ID"].to_numpy())
+        and np.array_equal(
+            result["b1"].to_numpy(),
+            image.values(points.LON.to_numpy(), points.LAT.to_numpy()),
+        )
+    )
+
+
+def check_dedupe(points, latency, workers):
+    """Submit one extraction three times while it runs, then once more after it finished."""
+    from utils.extraction import extract_points
+    from utils.jobs import DONE, JobQueue
+
+    queue = JobQueue(workers=workers)
+    image = FakeImage()
+    fake = FakeEarthEngine(latency=latency)
+    submit = lambda: queue.submit(
+        extract_points, image, points, backend=fake, key=("points", "b1")
+    )
+
+    start = time.perf_counter()
+    ids = [submit() for _ in range(3)]
+    job = wait(queue, ids[0])
+    wall = time.perf_counter() - start
+    requests = fake.requests
+    ids.append(submit())
+    return {
+        "passed": len(set(ids)) == 1
+        and job["status"] == DONE
+        and correct(job["result"], points, image)
+        and fake.requests == requests,
+        "wall_time_s": wall,
+        "job_ids": len(set(ids)),
+        "ee_requests": fake.requests,
+    }
+
+
+def check_failure(points, latency, workers):
+    """Fail every request, then resubmit the same key."""
+    from utils.extraction import extract_points
+    from utils.jobs import FAILED, JobQueue
+
+    queue = JobQueue(workers=workers)
+    fake = FakeEarthEngine(latency=latency, error_rate=1.0)
+    submit = lambda: queue.submit(
+        extract_points, FakeImage(), points, backend=fake, key="failing"
+    )
+
+    job_id = submit()
+    job = wait(queue, job_id)
+    retry_id = submit()
+    wait(queue, retry_id)
+    return {
+        "passed": job["status"] == FAILED
+        and "503 Service Unavailable" in job["error"]
+        and job["result"] is None
+        and retry_id != job_id,
+        "error": job["error"],
+        "resubmitted": retry_id != job_id,
+    }
+
+
+def check_expiry(points, latency, workers, ttl):
+    """Let a finished job outlive the ttl, then look it up and resubmit it."""
+    from utils.extraction import extract_points
+    from utils.jobs import DONE, JobQueue
+
+    queue = JobQueue(workers=workers, ttl=ttl)
+    fake = FakeEarthEngine(latency=latency)
+    submit = lambda: queue.submit(
+        extract_points, FakeImage(), points, backend=fake, key="expiring"
+    )
+
+    job_id = submit()
+    job = wait(queue, job_id)
+    kept = queue.status(job_id) is not None
+    time.sleep(ttl * 1.5)
+    expired = queue.status(job_id) is None
+    rerun_id = submit()
+    rerun = wait(queue, rerun_id)
+    return {
+        "passed": job["status"] == DONE
+        and kept
+        and expired
+        and rerun_id != job_id
+        and rerun["status"] == DONE,
+        "kept_before_ttl": kept,
+        "expired_after_ttl": expired,
+        "stats_after": queue.stats(),
+    }
+
+
+def check_concurrency(points, latency, workers, jobs):
+    """Submit more distinct jobs than workers and track how many run at once."""
+    from utils.extraction import extract_points
+    from utils.jobs import DONE, RUNNING, JobQueue
+
+    queue = JobQueue(workers=workers)
+    image = FakeImage()
+    fake = FakeEarthEngine(latency=latency)
+
+    start = time.perf_counter()
+    ids = [
+        queue.submit(extract_points, image, points, backend=fake, key=number)
+        for number in range(jobs)
+    ]
+    max_running = 0
+    while queue.stats()[DONE] < jobs:
+        max_running = max(max_running, queue.stats()[RUNNING])
+        time.sleep(0.005)
+    wall = time.perf_counter() - start
+    finished = [queue.status(job_id) for job_id in ids]
+    return {
+        "passed": max_running <= workers
+        and all(correct(job["result"], points, image) for job in finished),
+        "jobs": jobs,
+        "max_running": max_running,
+        "wall_time_s": wall,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--points", type=int, default=12_000)
+    parser.add_argument("--workers", type=int, default=2, help="Job queue workers.")
+    parser.add_argument(
+        "--jobs", type=int, default=6, help="Jobs for the concurrency case."
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Simulated seconds per request."
+    )
+    parser.add_argument(
+        "--ttl", type=float, default=0.5, help="Job ttl in seconds for the expiry case."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_jobs.json")
+    args = parser.parse_args(argv)
+
+    points = upload_points(args.points, args.seed)
+    results = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "points": args.points,
+        "cases": {
+            "dedupe": check_dedupe(points, args.latency, args.workers),
+            "failure": check_failure(points, args.latency, args.workers),
+            "expiry": check_expiry(points, args.latency, args.workers, args.ttl),
+            "concurrency": check_concurrency(
+                points, args.latency, args.workers, args.jobs
+            ),
+        },
+    }
+    for name, case in results["cases"].items():
+        details = "  ".join(f"{k}={v}" for k, v in case.items() if k != "passed")
+        print(f"{name:>11}: {'ok' if case['passed'] else 'FAILED'}  {details}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"Results written to {args.output}")
+    return 0 if all(case["passed"] for case in results["cases"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
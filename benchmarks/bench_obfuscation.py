@@ -0,0 +1,167 @@
+"""
+Benchmark the obfuscation engine behind the buffer pages.
+
+Runs create_obfuscated_points through obfuscate_in_chunks (what
+obfuscate_points on pages 1 and 2 call) on synthetic inventories spread
+over several UTM zones. No Streamlit server or network access is needed.
+Each case runs in a fresh process so peak RSS is measured per case.
+Every case also records the pyproj transformer lookups of its timed run,
+including those of the worker processes, to confirm that transformers
+are built during the warm-up and not on the hot path.
+
+Usage:
+    python benchmarks/bench_obfuscation.py
+    python benchmarks/bench_obfuscation.py --sizes 1000 100000 --samples 1 5 --output results.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+# Lon/lat boxes: CONUS (UTM 10-19 N), western South America (17-19 S), central Europe (33-36 N)
+REGIONS = [
+    (-124.0, -67.0, 25.0, 49.0),
+    (-80.0, -70.0, -40.0, -5.0),
+    (12.0, 30.0, 45.0, 60.0),
+]
+
+
+def synthetic_inventory(n_plots, seed=0):
+    """Random plot coordinates spread evenly over REGIONS."""
+    rng = np.random.default_rng(seed)
+    region = rng.integers(len(REGIONS), size=n_plots)
+    bounds = np.array(REGIONS)[region]
+    lon = rng.uniform(bounds[:, 0], bounds[:, 1])
+    lat = rng.uniform(bounds[:, 2], bounds[:, 3])
+    return lon, lat
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def run_case(n_plots, no_samp, method, radius, workers, seed):
+    """Time one obfuscation case; runs inside its own process."""
+    from utils.obfuscation import obfuscate_in_chunks
+    from utils.transformers import get_transformer_registry
+
+    lon, lat = synthetic_inventory(n_plots, seed=seed)
+    # Warm up transformer setup so it is not counted against the first case
+    obfuscate_in_chunks(
+        lon[:1000], lat[:1000], radius, no_samp=1, method=method, seed=seed
+    )
+
+    registry = get_transformer_registry()
+    before = registry.stats()
+    start = time.perf_counter()
+    obfuscate_in_chunks(
+        lon, lat, radius, no_samp=no_samp, method=method, seed=seed, workers=workers
+    )
+    wall = time.perf_counter() - start
+    # Lookups of the timed run; misses are transformer pairs built on the hot path
+    after = registry.stats()
+    lookups = {
+        f"transformer_{name}": after[name] - before[name]
+        for name in ("hits", "misses", "worker_hits", "worker_misses")
+    }
+
+    points = n_plots * no_samp
+    return {
+        "plots": n_plots,
+        "samples_per_plot": no_samp,
+        "points": points,
+        "method": method,
+        "workers": workers,
+        "wall_time_s": wall,
+        "points_per_s": points / wall if wall > 0 else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        **lookups,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--samples", type=int, nargs="+", default=[1, 5, 25])
+    parser.add_argument(
+        "--methods", nargs="+", default=["utm", "geodesic"], choices=["utm", "geodesic"]
+    )
+    parser.add_argument(
+        "--radius", type=float, default=1000, help="Buffer radius in feet."
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_obfuscation.json")
+    args = parser.parse_args(argv)
+
+    import pyproj
+    import shapely
+
+    results = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pyproj": pyproj.__version__,
+        "shapely": shapely.__version__,
+        "cases": [],
+    }
+
+    for method in args.methods:
+        for n_plots in args.sizes:
+            for no_samp in args.samples:
+                # A fresh process per case keeps peak RSS independent
+                with ProcessPoolExecutor(
+                    max_workers=1, mp_context=get_context("spawn")
+                ) as pool:
+                    case = pool.submit(
+                        run_case,
+                        n_plots,
+                        no_samp,
+                        method,
+                        args.radius,
+                        args.workers,
+                        args.seed,
+                    ).result()
+                results["cases"].append(case)
+                print(
+                    f"{method:>8} {n_plots:>9,} plots x {no_samp:>2} samples: "
+                    f"{case['wall_time_s']:8.3f} s  {case['points_per_s']:>12,.0f} pts/s  "
+                    f"{case['peak_rss_mb']:8.1f} MB  "
+                    f"transformers {case['transformer_hits'] + case['transformer_worker_hits']:>6,} hits "
+                    f"{case['transformer_misses'] + case['transformer_worker_misses']:>3} built"
+                )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Benchmark the Earth Engine request scheduler against injected throttling.
+
+Runs utils.extraction.sample_points with benchmarks/fake_ee.py as the
+backend in two scenarios. In the first the fake refuses requests above a
+concurrency limit with a 429 and fails a share of the rest with a 503.
+In the second nothing fails, but every request slows down once more
+than a few are in flight, which the scheduler can only notice from the
+latency. Each scenario runs once with the fake called directly, as the
+pages did before, and once through utils.extraction.ScheduledBackend with
+a fresh RequestScheduler. It reports whether the extraction completed
+with correct values, the wall time, the failures injected, the retries
+made, the requests found slow and the concurrency limit
+the scheduler settled on.
+
+Usage:
+    python benchmarks/bench_scheduler.py
+    python benchmarks/bench_scheduler.py --points 50000 --workers 8 --throttle-above 3 --error-rate 0.05
+    python benchmarks/bench_scheduler.py --slow-above 2 --slowdown 0.1
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_extraction import synthetic_points
+from benchmarks.fake_ee import FakeEarthEngine, FakeImage
+
+
+def run_case(
+    n_points,
+    workers,
+    batch_size,
+    latency,
+    throttle_above,
+    error_rate,
+    base_delay,
+    seed,
+    use_scheduler,
+    slow_above=None,
+    slowdown=0.0,
+):
+    """Time one extraction against the throttling fake, with or without the scheduler."""
+    from utils.extraction import ScheduledBackend, sample_points
+    from utils.scheduler import RequestScheduler
+
+    gdf = synthetic_points(n_points, seed=seed)
+    image = FakeImage()
+    fake = FakeEarthEngine(
+        latency=latency,
+        throttle_above=throttle_above,
+        error_rate=error_rate,
+        slow_above=slow_above,
+        slowdown=slowdown,
+        seed=seed,
+    )
+    scheduler = RequestScheduler(
+        rate=1000, burst=workers, max_concurrency=workers, base_delay=base_delay
+    )
+    backend = ScheduledBackend(fake, scheduler) if use_scheduler else fake
+
+    sampled, error = None, None
+    start = time.perf_counter()
+    try:
+        sampled = sample_points(
+            image, gdf, batch_size=batch_size, workers=workers, backend=backend
+        )
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+    wall = time.perf_counter() - start
+
+    correct = sampled is not None and bool(
+        np.array_equal(
+            sampled["b1"].to_numpy(),
+            image.values(gdf.LON.to_numpy(), gdf.LAT.to_numpy()),
+        )
+    )
+    case = {
+        "scheduler": use_scheduler,
+        "points": n_points,
+        "workers": workers,
+        "batch_size": batch_size,
+        "latency_s": latency,
+        "throttle_above": throttle_above,
+        "error_rate": error_rate,
+        "slow_above": slow_above,
+        "slowdown_s": slowdown,
+        "wall_time_s": wall,
+        "completed": sampled is not None,
+        "correct": correct,
+        "error": error,
+        **{f"ee_{name}": value for name, value in fake.stats().items()},
+    }
+    if use_scheduler:
+        case.update(
+            {f"scheduler_{name}": value for name, value in scheduler.stats().items()}
+        )
+    return case
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--points", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--latency", type=float, default=0.1, help="Simulated seconds per request."
+    )
+    parser.add_argument(
+        "--throttle-above", type=int, default=3, help="Requests in flight before 429s."
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.05,
+        help="Share of requests failing with 503.",
+    )
+    parser.add_argument(
+        "--slow-above",
+        type=int,
+        default=2,
+        help="Requests in flight before the slowdown scenario's requests slow down.",
+    )
+    parser.add_argument(
+        "--slowdown",
+        type=float,
+        default=0.1,
+        help="Extra seconds per request in flight beyond --slow-above.",
+    )
+    parser.add_argument(
+        "--base-delay", type=float, default=0.1, help="First retry backoff in seconds."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_scheduler.json")
+    args = parser.parse_args(argv)
+
+    results = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "cases": [],
+    }
+
+    scenarios = {
+        "throttling": dict(
+            throttle_above=args.throttle_above, error_rate=args.error_rate
+        ),
+        "slowdown": dict(
+            throttle_above=None,
+            error_rate=0.0,
+            slow_above=args.slow_above,
+            slowdown=args.slowdown,
+        ),
+    }
+    for scenario, options in scenarios.items():
+        print(f"{scenario}:")
+        for use_scheduler in (False, True):
+            case = run_case(
+                args.points,
+                args.workers,
+                args.batch_size,
+                args.latency,
+                base_delay=args.base_delay,
+                seed=args.seed,
+                use_scheduler=use_scheduler,
+                **options,
+            )
+            case["scenario"] = scenario
+            results["cases"].append(case)
+            print(_summary(case))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+def _summary(case):
+    line = (
+        f"{'scheduled' if case['scheduler'] else 'direct':>11}: {case['wall_time_s']:8.3f} s  "
+        f"completed={case['completed']} correct={case['correct']}  "
+        f"{case['ee_requests']:>4} requests  {case['ee_throttled']:>3} throttled  {case['ee_errors']:>3} errors"
+    )
+    if case["scheduler"]:
+        line += (
+            f"  {case['scheduler_retries']:>3} retries  {case['scheduler_slowed']:>3} slowed"
+            f"  limit {case['scheduler_limit']:.2f}"
+        )
+    return line
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Offline stand-in for the Earth Engine calls made through geemap.
+
+FakeEarthEngine provides the methods of utils.extraction.GeemapBackend,
+so it can be passed as the backend of the extraction functions. Requests
+are lazy like Earth Engine's: nothing is computed until ee_to_df or
+group_mean, which play the getInfo round trip. That call sleeps for
+a fixed latency plus a per-feature cost and refuses collections above
+the element limit, as the interactive API does. Throttling can be
+injected: requests beyond a concurrency limit fail with a 429, and a
+share of the rest with a 503. Latency can also grow with the number
+of requests in flight, as it does on a loaded server. Band values depend only
+on the pixel a point falls in, so results can be checked against a
+direct computation.
+"""
+
+import random
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+
+class FakeImage:
+    """Image on a regular WGS84 grid whose value is derived from the pixel."""
+
+    def __init__(self, scale=0.01, masked=None):
+        self.scale = scale
+        # Optional function of (lon, lat) arrays returning True where the image is masked
+        self.masked = masked
+
+    def select(self, band):
+        return self
+
+    def projection(self):
+        return _Info(
+            {
+                "type": "Projection",
+                "crs": "EPSG:4326",
+                "transform": [self.scale, 0, 0, 0, -self.scale, 0],
+            }
+        )
+
+    def values(self, lon, lat):
+        col = np.floor(lon / self.scale)
+        row = np.floor(-lat / self.scale)
+        return col * 100_003 + row
+
+
+class _Info:
+    def __init__(self, info):
+        self._info = info
+
+    def getInfo(self):
+        return self._info
+
+
+class FakeFeatureCollection:
+    def __init__(self, features, image=None):
+        self.features = features
+        self.image = image
+
+
+class FakeEarthEngine:
+    """
+    geemap-shaped backend with configurable latency and request limits.
+
+    Args:
+        latency (float): Seconds per request.
+        per_feature (float): Extra seconds per feature in a request.
+        max_elements (int): Largest collection a request may return.
+        throttle_above (int, optional): Requests in flight beyond which a
+            request is refused with "429 Too Many Requests".
+        error_rate (float): Share of requests failing with "503 Service Unavailable".
+        slow_above (int, optional): Requests in flight beyond which every
+            request takes longer, as a server does under load.
+        slowdown (float): Extra seconds per request in flight beyond slow_above.
+        seed (int, optional): Seeds the injected failures.
+    """
+
+    def __init__(
+        self,
+        latency=0.2,
+        per_feature=0.0,
+        max_elements=5000,
+        throttle_above=None,
+        error_rate=0.0,
+        slow_above=None,
+        slowdown=0.0,
+        seed=None,
+    ):
+        self.latency = latency
+        self.per_feature = per_feature
+        self.max_elements = max_elements
+        self.throttle_above = throttle_above
+        self.error_rate = error_rate
+        self.slow_above = slow_above
+        self.slowdown = slowdown
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rows = 0
+        self.throttled = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def geojson_to_ee(self, geojson):
+        return FakeFeatureCollection(geojson["features"])
+
+    def extract_values_to_points(self, fc, image, scale=None, **kwargs):
+        return FakeFeatureCollection(fc.features, image)
+
+    def ee_to_df(self, fc, **kwargs):
+        n = len(fc.features)
+        if n > self.max_elements:
+            raise RuntimeError(
+                f"Collection query aborted after accumulating over {self.max_elements} elements."
+            )
+        return self._request(n, lambda: self._sample(fc))
+
+    def band_names(self, image):
+        return self._request(0, lambda: ["b1"])
+
+    def group_mean(self, fc, bands, group_column):
+        # Grouping runs server side, so only the groups count against the element limit
+        def reduce():
+            grouped = self._sample(fc).groupby(group_column)[list(bands)].mean()
+            if len(grouped) > self.max_elements:
+                raise RuntimeError(
+                    f"Collection query aborted after accumulating over {self.max_elements} elements."
+                )
+            return grouped
+
+        return self._request(len(fc.features), reduce)
+
+    def _request(self, n, compute):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            throttled = (
+                self.throttle_above is not None and self.in_flight > self.throttle_above
+            )
+            failed = not throttled and self._random.random() < self.error_rate
+            delay = self.latency + self.per_feature * n
+            if self.slow_above is not None:
+                delay += self.slowdown * max(0, self.in_flight - self.slow_above)
+            self.throttled += throttled
+            self.errors += failed
+        try:
+            if throttled:
+                time.sleep(self.latency / 10)
+                raise RuntimeError(
+                    "429 Too Many Requests: too many concurrent requests."
+                )
+            time.sleep(delay)
+            if failed:
+                raise RuntimeError("503 Service Unavailable")
+            result = compute()
+            with self._lock:
+                self.rows += len(result)
+            return result
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def stats(self):
+        """Return request, row and injected failure counts and the peak number of requests in flight."""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "rows": self.rows,
+                "throttled": self.throttled,
+                "errors": self.errors,
+                "max_in_flight": self.max_in_flight,
+            }
+
+    @staticmethod
+    def _sample(fc):
+        properties = pd.DataFrame([feature["properties"] for feature in fc.features])
+        coordinates = np.array(
+            [feature["geometry"]["coordinates"] for feature in fc.features],
+            dtype="float64",
+        ).reshape(-1, 2)
+        lon, lat = coordinates[:, 0], coordinates[:, 1]
+        properties["b1"] = fc.image.values(lon, lat)
+        if fc.image.masked is not None:
+            properties = properties[~fc.image.masked(lon, lat)]
+        return properties.reset_index(drop=True)
@@ -1,90 +1,124 @@
 import streamlit as st
-import requests
 import pandas as pd
 import geopandas as gpd
 import numpy as np
 import io
-from pyproj import Transformer
+import os
+import tempfile
+from utils.catalog import get_catalog
+from utils.ee_metadata import get_metadata_cache
+from utils.ingest import INVALID_ROW_ACTIONS, UPLOAD_TYPES, ChunkValidator, apply_validation, file_kind, read_header, read_points, report_invalid_rows, resolve_columns, spill_upload, upload_fingerprint
+from utils.obfuscation import SPOOL_MAX_SIZE, create_obfuscated_circles, new_seed, obfuscate_in_chunks, parse_seed, stream_obfuscated_csv
 import json
-from shapely.geometry import Point
-import shapely
 
 # Define functions
-@st.cache_data(hash_funcs={shapely.geometry.Point: lambda p: p.wkb})
-def create_obfuscated_point(point, radius, _crs="EPSG:4326"):
+def build_obfuscated_points(data, radius, plot_id_col, method="utm", seed=None, distribution="uniform", min_offset=0, sigma=None, workers=1, progress=None):
         """
-        Create a circle polygon (as a shapely geometry) with the given radius in feet,
-        where the provided point is randomly located inside the circle (not at the center).
+        Obfuscate points within a radius and save as csv.
+
+        Args:
+            data (pd.DataFrame): LAT, LON and plot_ID columns, as returned by utils.ingest.read_points.
+            radius (float): Radius of the circle in feet.
+            plot_id_col (str): Column name for plot IDs.
+            method (str): "utm" to offset in the local UTM zone, "geodesic" to offset on the WGS84 ellipsoid.
+            seed (int, optional): Seed for reproducible offsets. Defaults to fresh randomness.
+            distribution (str): "uniform" (over the circle area), "linear", "annulus" or "gaussian".
+            min_offset (float): Minimum offset in feet for the annulus distribution.
+            sigma (float, optional): Standard deviation in feet for the gaussian distribution.
+            workers (int): Number of worker processes to split the rows across.
+            progress (callable, optional): Receives the finished fraction as chunks complete.
+
+        Returns:
+            pd.DataFrame: Plot IDs with the obfuscated lat and lon.
         """
-        # Convert radius from feet to meters
-        radius = radius * 0.3048
-
-        # Project to local UTM for accurate distance calculations
-        utm_crs = f"EPSG:326{int((point.x + 180) // 6) + 1}"
-        transformer_to_utm = Transformer.from_crs(_crs, utm_crs, always_xy=True)
-        transformer_to_latlon = Transformer.from_crs(utm_crs, _crs, always_xy=True)
-        x, y = transformer_to_utm.transform(point.x, point.y)
-
-        # Randomize the point's location within the circle
-        angle = np.random.uniform(0, 2 * np.pi)
-        distance = np.random.uniform(0, 1)*radius  # Random distance from the center, scaled by radius
-        # Calculate center of the circle so that the point is inside the circle but not at the center
-        center_x = x - distance * np.cos(angle)
-        center_y = y - distance * np.sin(angle)
-        center = Point(center_x, center_y)
-
-        # Transform the circle back to WGS84
-        center_latlon = shapely.ops.transform(
-            lambda x, y: transformer_to_latlon.transform(x, y), center
-        )
-        return center_latlon
-       
+        coordinates = data
+        lon, lat = coordinates.LON.to_numpy(), coordinates.LAT.to_numpy()
+
+        center_lon, center_lat = obfuscate_in_chunks(lon, lat, radius, no_samp=1, method=method, seed=seed, workers=workers, progress=progress,
+            distribution=distribution, min_offset=min_offset, sigma=sigma, validate=True)
 
-@st.cache_data(hash_funcs={shapely.geometry.Point: lambda p: p.wkb})
-def obfuscate_points(data, radius, plot_id_col):
+        df = pd.DataFrame({plot_id_col: coordinates[plot_id_col].to_numpy(),
+            'lat': center_lat[:, 0],
+            'lon': center_lon[:, 0]})
+
+        return df
+
+@st.cache_data
+def obfuscate_points(_data, fingerprint, radius, plot_id_col, method="utm", seed=None, distribution="uniform", min_offset=0, sigma=None):
         """
-        Obfuscate points within a radius and save as csv.
+        Cached build_obfuscated_points, run in a single process.
+
+        Only seeded runs are cached; unseeded runs call build_obfuscated_points
+        directly so every run draws fresh offsets. Runs with several workers do
+        too, so the page can drive its progress bar; Streamlit cannot replay
+        updates to an element created outside a cached function on a cache hit.
 
         Args:
-            data (str, pd.DataFrame, gpd.GeoDataFrame): Input data (GeoJSON, DataFrame, or GeoDataFrame).
-            radius (float): Radius of the circle in meters.
+            _data (pd.DataFrame): Input data. Not hashed by the cache.
+            fingerprint (str): Content hash of the upload (see utils.ingest.fingerprint), the cache key for _data.
+            radius, plot_id_col, method, seed, distribution, min_offset, sigma: As in build_obfuscated_points.
+
+        Returns:
+            pd.DataFrame: Plot IDs with the obfuscated lat and lon.
+        """
+        return build_obfuscated_points(_data, radius, plot_id_col, method=method, seed=seed,
+            distribution=distribution, min_offset=min_offset, sigma=sigma)
+
+def build_obfuscated_circles(data, radius, plot_id_col, method="utm", seed=None, distribution="uniform", min_offset=0, sigma=None, file_format="geojson"):
+        """
+        Create an obfuscation circle around each point and save as GeoJSON or GeoParquet.
+
+        Args:
+            data (pd.DataFrame): LAT, LON and plot_ID columns, as returned by utils.ingest.read_points.
+            radius (float): Radius of the circle in feet.
             plot_id_col (str): Column name for plot IDs.
-            output_file (str): Path to save the output GeoJSON file.
+            method (str): "utm" to buffer in the local UTM zone, "geodesic" to build the circles on the WGS84 ellipsoid.
+            seed (int, optional): Seed for reproducible circles. Defaults to fresh randomness.
+            distribution (str): Where the point falls inside its circle, as in obfuscate_points.
+            min_offset (float): Minimum offset in feet for the annulus distribution.
+            sigma (float, optional): Standard deviation in feet for the gaussian distribution.
+            file_format (str): "geojson" or "geoparquet".
+
+        Returns:
+            bytes: The circles with their plot IDs in the requested format.
         """
-        if isinstance(data, str):
-            coordinates = pd.read_csv(data)
-            gdf = gpd.GeoDataFrame(
-                coordinates,
-                geometry=gpd.points_from_xy(coordinates.LON, coordinates.LAT),
-                crs="EPSG:4326",  # Directly set CRS during creation
-            )
-        elif isinstance(data, pd.DataFrame):
-            coordinates = data
-            gdf = gpd.GeoDataFrame(
-                coordinates,
-                geometry=gpd.points_from_xy(coordinates.LON, coordinates.LAT),
-                crs="EPSG:4326",  # Directly set CRS during creation
-            )
-        else:
-            gdf = data.to_crs(epsg=4326)  # Ensure WGS84
-
-        centers = []
-        ids = []
-        for idx, row in gdf.iterrows():
-            point = row["geometry"]
-            center = create_obfuscated_point(point, radius, _crs=gdf.crs)
-            centers.append(center)
-            ids.append(row[plot_id_col])
-            # Create new GeoDataFrame
-        df = pd.DataFrame({plot_id_col: ids,
-            'lat': [p.y for p in centers],
-            'lon': [p.x for p in centers]})
-        
-        return df
+        coordinates = data
+        lon, lat = coordinates.LON.to_numpy(), coordinates.LAT.to_numpy()
+
+        circles = create_obfuscated_circles(
+            lon, lat, radius, method=method, seed=seed,
+            distribution=distribution, min_offset=min_offset, sigma=sigma
+        )
+        gdf_circles = gpd.GeoDataFrame(
+            {plot_id_col: coordinates[plot_id_col].to_numpy()}, geometry=circles, crs="EPSG:4326"
+        )
+
+        if file_format == "geoparquet":
+            buffer = io.BytesIO()
+            gdf_circles.to_parquet(buffer)
+            return buffer.getvalue()
+        return gdf_circles.to_json().encode("utf-8")
 
 @st.cache_data
-def convert_for_download(df):
-    return df.to_csv().encode("utf-8")
+def obfuscate_circles(_data, fingerprint, radius, plot_id_col, method="utm", seed=None, distribution="uniform", min_offset=0, sigma=None, file_format="geojson"):
+        """
+        Cached build_obfuscated_circles for seeded runs.
+
+        Args:
+            _data (pd.DataFrame): Input data. Not hashed by the cache.
+            fingerprint (str): Content hash of the upload (see utils.ingest.fingerprint), the cache key for _data.
+            radius, plot_id_col, method, seed, distribution, min_offset, sigma, file_format: As in build_obfuscated_circles.
+
+        Returns:
+            bytes: The circles with their plot IDs in the requested format.
+        """
+        return build_obfuscated_circles(_data, radius, plot_id_col, method=method, seed=seed,
+            distribution=distribution, min_offset=min_offset, sigma=sigma, file_format=file_format)
+
+@st.cache_data
+def convert_for_download(_df, cache_key):
+    # cache_key identifies _df (upload fingerprint plus parameters) so the frame is never hashed
+    return _df.to_csv().encode("utf-8")
 
 # Beginning of web app development
 st.set_page_config(page_title='Extract GEE Data from Coordinates', layout='wide')
@@ -116,22 +150,27 @@ st.header("Optional Preliminary Step to Point Extraction Module.")
 col1, col2 = st.columns(2)
 with col1:
 
-    url = "https://raw.githubusercontent.com/opengeos/geospatial-data-catalogs/master/gee_catalog.json"
-
-    response = requests.get(url)
-    data = response.json()
-
-    data_dict = {item["id"]: item["url"] for item in data if "id" in item}
-    df = pd.DataFrame(list(data_dict.items()), columns=['id', 'url'])
-    geedata = st.selectbox('Optional: check resolution of Google Earth Engine dataset to determine appropriate buffer area.', df['id'])
-    url = data_dict.get(str(geedata))
+    catalog = get_catalog().index()
+    dataset_search = st.text_input('Search datasets', placeholder='e.g. landsat 8 toa', help='Narrows the dataset list to ids and titles with words starting with each search word.')
+    geedata = st.selectbox('Optional: check resolution of Google Earth Engine dataset to determine appropriate buffer area.', catalog.search(dataset_search))
+    entry = catalog.get(str(geedata))
+    url = entry.url if entry else None
 
     st.write('Dataset ID:', url)
+    if entry:
+        first_date, last_date = entry.date_range()
+        st.write('Date range:', f"{first_date or 'unknown'} to {last_date or 'unknown'}")
+        # Filled in by the extraction pages, which describe every dataset they load
+        metadata = get_metadata_cache().peek(entry.id)
+        if metadata and metadata['scale']:
+            st.write('Native resolution:', f"{metadata['scale']:g} m (about {metadata['scale'] * 3.28084:,.0f} ft)")
+        else:
+            st.write('Native resolution: see the dataset page above. It is shown here once the dataset has been used on an extraction page.')
     
 with col2:
     uploaded_file = st.file_uploader(
-        "Step 1: Upload a CSV file.",
-        type=["csv"],
+        "Step 1: Upload a CSV, Parquet, GeoParquet or Feather file.",
+        type=UPLOAD_TYPES,
         help="Double check that your CSV file is formatted correctly with LAT and LONG columns.")
     markdown = """
                 Accepted names for uploaded CSV file: \n
@@ -144,63 +183,166 @@ with col2:
                 [Example file](https://raw.githubusercontent.com/taraskiba/streamlit-skiba/refs/heads/main/sample_data/coordinate-point-formatting.csv)
                 """
     st.markdown(markdown)
+    invalid_rows = st.selectbox('Rows that fail validation', list(INVALID_ROW_ACTIONS), help='Rows with the wrong number of fields, missing or out-of-range coordinates, missing plot IDs or duplicate plot IDs are caught before any processing.')
 
 # Second row
 col1, col2 = st.columns(2)
 with col1:
     buffer_distance = st.number_input('Step 2: Buffer Distance (in ft)', min_value=0, value=1000, step=1, key='buffer_distance)')
+    offset_methods = {'UTM projection': 'utm', 'Geodesic (WGS84)': 'geodesic'}
+    offset_method = st.selectbox('Offset method', list(offset_methods), help='Geodesic offsets skip the UTM projection and work in both hemispheres.')
+    reproducible = st.checkbox('Reproducible offsets', help='Generates a secret seed that reproduces the same obfuscated coordinates. Anyone holding the seed and the output can undo the obfuscation, so it is shown once and never written to the output.')
+    seed_text = ''
+    if reproducible:
+        seed_text = st.text_input('Optional: seed from an earlier run', type='password', help='The seed is a secret that undoes the obfuscation; keep it away from the output file. Leave blank to generate a new one.')
+    distributions = {
+        'Uniform over circle area': 'uniform',
+        'Uniform distance from center (legacy)': 'linear',
+        'Annulus (minimum offset)': 'annulus',
+        'Gaussian': 'gaussian',
+    }
+    distribution = st.selectbox('Sample distribution', list(distributions), help='Uniform over the circle area spreads samples evenly; the legacy option clusters them near the center.')
+    min_offset, sigma = 0, None
+    if distributions[distribution] == 'annulus':
+        min_offset = st.number_input('Minimum offset (in ft)', min_value=0, max_value=int(buffer_distance), value=0, step=1)
+    elif distributions[distribution] == 'gaussian':
+        sigma = st.number_input('Gaussian standard deviation (in ft)', min_value=1, value=max(int(buffer_distance) // 2, 1), step=1)
+    workers = st.number_input('Worker processes', min_value=1, max_value=os.cpu_count() or 1, value=1, step=1, help='Split large files across several processes.')
+    stream_output = st.checkbox('Stream large file', help='Read and write the file in chunks to keep memory use flat. Runs in a single process.')
+    output_modes = {
+        'Obfuscated point (CSV)': ('point', 'csv'),
+        'Obfuscation circle (GeoJSON)': ('circle', 'geojson'),
+        'Obfuscation circle (GeoParquet)': ('circle', 'parquet'),
+    }
+    output_mode = st.selectbox('Output', list(output_modes), help='Circles contain the original location and can be passed to area tools.')
 
 with col2:
     st.button("Reset", type="primary")
     if st.button("Run Query"):
         if uploaded_file is not None:
-            file_info = uploaded_file.getvalue()
-            points = pd.read_csv(io.BytesIO(file_info))
-
-            lat_cols = ['lat', 'latitude', 'y', 'LAT', 'Latitude', 'Lat','Y']
-            lon_cols = ['lon', 'long', 'longitude', 'x', 'LON', 'Longitude', 'Long', 'X']
-            id_cols = ['id', 'ID', 'plot_ID', 'plot_id', 'plotID', 'plotId']
-
-            def find_column(possible_names, columns):
-                for name in possible_names:
-                    if name in columns:
-                        return name
-                # fallback: check case-insensitive match
-                lower_columns = {c.lower(): c for c in columns}
-                for name in possible_names:
-                    if name.lower() in lower_columns:
-                        return lower_columns[name.lower()]
-                raise ValueError(f"No matching column found for {possible_names}")
-            
-            lat_col = find_column(lat_cols, points.columns)
-            lon_col = find_column(lon_cols, points.columns)
-            id_col = find_column(id_cols, points.columns)
-
-            points = points.rename(columns={lat_col: 'LAT', lon_col: 'LON', id_col: 'plot_ID'})
+            seed, seed_is_new = None, False
+            if reproducible and seed_text:
+                try:
+                    seed = parse_seed(seed_text)
+                except ValueError as e:
+                    st.error(str(e))
+                    st.stop()
+            elif reproducible:
+                seed, seed_is_new = new_seed(), True
+
+            output_shape, output_ext = output_modes[output_mode]
+            if output_shape == 'circle':
+                stream_output = False
+            if file_kind(uploaded_file.name) != 'csv':
+                stream_output = False  # Columnar files are read through Arrow instead
+
+            if stream_output:
+                # Only check the header; the rows are read and validated in chunks later
+                try:
+                    resolve_columns(read_header(uploaded_file))
+                except ValueError as e:
+                    st.error(f"Could not read {uploaded_file.name}: {e}")
+                    st.stop()
+                validator = ChunkValidator(uploaded_file)
+            else:
+                # Large uploads are parsed from a temp file instead of in memory
+                try:
+                    points = read_points(spill_upload(uploaded_file, st.session_state), uploaded_file.name)
+                except ValueError as e:
+                    st.error(f"Could not read {uploaded_file.name}: {e}")
+                    st.stop()
+                points = apply_validation(points, INVALID_ROW_ACTIONS[invalid_rows])
+            fingerprint = upload_fingerprint(uploaded_file, st.session_state)
         
-            if not geedata:
-                st.error("Please ensure all fields are filled out correctly.")
+            progress_bar = st.progress(0.0, text="Obfuscating points...")
+            if output_shape == 'circle':
+                circle_options = dict(
+                    radius=buffer_distance,
+                    plot_id_col="plot_ID",
+                    method=offset_methods[offset_method],
+                    seed=seed,
+                    distribution=distributions[distribution],
+                    min_offset=min_offset,
+                    sigma=sigma,
+                    file_format="geoparquet" if output_ext == 'parquet' else "geojson"
+                )
+                if seed is None:
+                    # Not cached, so unseeded circles are drawn fresh on every run
+                    csv = build_obfuscated_circles(points, **circle_options)
+                else:
+                    csv = obfuscate_circles(_data=points, fingerprint=fingerprint, **circle_options)
+                progress_bar.progress(1.0)
+            elif stream_output:
+                csv = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+b")
+                plots = stream_obfuscated_csv(
+                    uploaded_file,
+                    csv,
+                    radius=buffer_distance,
+                    method=offset_methods[offset_method],
+                    seed=seed,
+                    distribution=distributions[distribution],
+                    min_offset=min_offset,
+                    sigma=sigma,
+                    validate=True,
+                    check=validator,
+                    progress=lambda rows: progress_bar.progress(
+                        min(uploaded_file.tell() / max(uploaded_file.size, 1), 1.0),
+                        text=f"{rows:,} plots obfuscated"
+                    )
+                )
+                # Invalid rows were left out as they were read; stopping withholds the download
+                report = validator.report()
+                report_invalid_rows(report, plots + len(report), INVALID_ROW_ACTIONS[invalid_rows])
+                # The download button needs the finished file as bytes
+                csv.seek(0)
+                csv = csv.read()
+            elif workers > 1 or seed is None:
+                # Not cached, so unseeded runs get fresh offsets and the bar can follow the chunks
+                returned_df = build_obfuscated_points(
+                    points,
+                    radius=buffer_distance,
+                    plot_id_col="plot_ID",
+                    method=offset_methods[offset_method],
+                    seed=seed,
+                    distribution=distributions[distribution],
+                    min_offset=min_offset,
+                    sigma=sigma,
+                    workers=workers,
+                    progress=progress_bar.progress
+                )
+                csv = returned_df.to_csv().encode("utf-8")
             else:
-                # convert date/time: pd.to_datetime('2024-12-31') 
                 returned_df = obfuscate_points(
-                    data=points,
+                    _data=points,
+                    fingerprint=fingerprint,
                     radius=buffer_distance,
-                    plot_id_col="plot_ID"
+                    plot_id_col="plot_ID",
+                    method=offset_methods[offset_method],
+                    seed=seed,
+                    distribution=distributions[distribution],
+                    min_offset=min_offset,
+                    sigma=sigma
                 )
-                file_name = f"buffered_coordinates_{buffer_distance}ft.csv"
+                progress_bar.progress(1.0)
+                csv = convert_for_download(returned_df, cache_key=(fingerprint, buffer_distance, offset_method, seed, distribution, min_offset, sigma))
 
-                csv = convert_for_download(returned_df)
+            # Never put the seed in the file name: with it the offsets can be recomputed and removed
+            file_name = f"buffered_coordinates_{buffer_distance}ft.{output_ext}"
 
-                if csv:
-                    st.success("Data extraction complete! You can download the results.")
-                    st.download_button(
-                        label="Download Results",
-                        data=csv,
-                        file_name=file_name
-                    )
-                else:
-                    st.error("No data extracted. Please check your inputs and try again.")
-                    
+            if csv:
+                st.success("Data extraction complete! You can download the results.")
+                st.download_button(
+                    label="Download Results",
+                    data=csv,
+                    file_name=file_name,
+                    on_click="ignore"  # A rerun would drop the other download button
+                )
+                if seed_is_new:
+                    st.warning("Record this seed somewhere private to reproduce these results. It is shown only once, and anyone holding it can undo the obfuscation.")
+                    st.code(str(seed), language=None)
+            else:
+                st.error("No data extracted. Please check your inputs and try again.")
+                
         else:
             st.error("Please upload a CSV file with LAT and LONG columns.")    
         
@@ -1,94 +1,77 @@
 import streamlit as st
-import requests
 import pandas as pd
 import geopandas as gpd
 import numpy as np
 import io
-from pyproj import Transformer
+import os
+import tempfile
+from utils.catalog import get_catalog
+from utils.ee_metadata import get_metadata_cache
+from utils.ingest import INVALID_ROW_ACTIONS, UPLOAD_TYPES, ChunkValidator, apply_validation, file_kind, read_header, read_points, report_invalid_rows, resolve_columns, spill_upload, upload_fingerprint
+from utils.obfuscation import SPOOL_MAX_SIZE, new_seed, obfuscate_in_chunks, parse_seed, stream_obfuscated_csv
 import json
-from shapely.geometry import Point
-import shapely
 import pointpats
 
 # Define functions
-@st.cache_data(hash_funcs={shapely.geometry.Point: lambda p: p.wkb})
-def create_obfuscated_points(point, radius, no_samp, _crs="EPSG:4326"):
-        """
-        Create a circle polygon (as a shapely geometry) with the given radius in feet,
-        where the provided point is randomly located inside the circle (not at the center)
-        and sample a specifed number of points within the circle.
-        """
-        # Convert radius from feet to meters
-        radius_m = radius * 0.3048
-
-        # Project to local UTM for accurate distance calculations
-        utm_crs = f"EPSG:326{int((point.x + 180) // 6) + 1}"
-        transformer_to_utm = Transformer.from_crs(_crs, utm_crs, always_xy=True)
-        transformer_to_latlon = Transformer.from_crs(utm_crs, _crs, always_xy=True)
-        x, y = transformer_to_utm.transform(point.x, point.y)
-
-        points = []
-        for no in range(no_samp):   
-            # Randomize the point's location within the circle
-            angle = np.random.uniform(0, 2 * np.pi)
-            distance = np.random.uniform(0, 1)*radius_m  # Random distance from the center, scaled by radius
-            # Calculate center of the circle so that the point is inside the circle but not at the center
-            center_x = x - distance * np.cos(angle)
-            center_y = y - distance * np.sin(angle)
-            center = Point(center_x, center_y)
-            center_latlon = shapely.ops.transform(
-                lambda x, y: transformer_to_latlon.transform(x, y), center
-            )
-            points.append(center_latlon)
-        return points
-
-
-@st.cache_data(hash_funcs={shapely.geometry.Point: lambda p: p.wkb})
-def obfuscate_points(data, radius, no_samp, plot_id_col):
+def build_obfuscated_points(data, radius, no_samp, plot_id_col, method="utm", seed=None, distribution="uniform", min_offset=0, sigma=None, workers=1, progress=None):
         """
         Obfuscate points within a radius and save as csv.
 
         Args:
-            data (str, pd.DataFrame, gpd.GeoDataFrame): Input data (GeoJSON, DataFrame, or GeoDataFrame).
-            radius (float): Radius of the circle in meters.
+            data (pd.DataFrame): LAT, LON and plot_ID columns, as returned by utils.ingest.read_points.
+            radius (float): Radius of the circle in feet.
+            no_samp (int): Number of samples to pull per plot.
             plot_id_col (str): Column name for plot IDs.
-            output_file (str): Path to save the output GeoJSON file.
+            method (str): "utm" to offset in the local UTM zone, "geodesic" to offset on the WGS84 ellipsoid.
+            seed (int, optional): Seed for reproducible offsets. Defaults to fresh randomness.
+            distribution (str): "uniform" (over the circle area), "linear", "annulus" or "gaussian".
+            min_offset (float): Minimum offset in feet for the annulus distribution.
+            sigma (float, optional): Standard deviation in feet for the gaussian distribution.
+            workers (int): Number of worker processes to split the rows across.
+            progress (callable, optional): Receives the finished fraction as chunks complete.
+
+        Returns:
+            pd.DataFrame: One row per sample with plot_ID, lat and lon.
         """
-        if isinstance(data, str):
-            coordinates = pd.read_csv(data)
-            gdf = gpd.GeoDataFrame(
-                coordinates,
-                geometry=gpd.points_from_xy(coordinates.LON, coordinates.LAT),
-                crs="EPSG:4326",  # Directly set CRS during creation
-            )
-        elif isinstance(data, pd.DataFrame):
-            coordinates = data
-            gdf = gpd.GeoDataFrame(
-                coordinates,
-                geometry=gpd.points_from_xy(coordinates.LON, coordinates.LAT),
-                crs="EPSG:4326",  # Directly set CRS during creation
-            )
-        else:
-            gdf = data.to_crs(epsg=4326)  # Ensure WGS84
+        coordinates = data
+        lon, lat = coordinates.LON.to_numpy(), coordinates.LAT.to_numpy()
 
-        centers = []
+        sample_lon, sample_lat = obfuscate_in_chunks(lon, lat, radius, no_samp=no_samp, method=method, seed=seed, workers=workers, progress=progress,
+            distribution=distribution, min_offset=min_offset, sigma=sigma, validate=True)
 
-        for idx, row in gdf.iterrows():
-            point = row["geometry"]
-            center = create_obfuscated_points(point, radius, no_samp, _crs=gdf.crs)
-            for pt in center:
-                centers.append({'plot_ID': row[plot_id_col],
-                                'lat': pt.y,
-                                'lon':pt.x})
-            # Create new GeoDataFrame
-        df = pd.DataFrame(centers)
+        # Samples are laid out plot by plot, so repeat each ID no_samp times
+        df = pd.DataFrame({'plot_ID': np.repeat(coordinates[plot_id_col].to_numpy(), no_samp),
+                           'lat': sample_lat.ravel(),
+                           'lon': sample_lon.ravel()})
 
         return df
 
+@st.cache_data
+def obfuscate_points(_data, fingerprint, radius, no_samp, plot_id_col, method="utm", seed=None, distribution="uniform", min_offset=0, sigma=None):
+        """
+        Cached build_obfuscated_points, run in a single process.
+
+        Only seeded runs are cached; unseeded runs call build_obfuscated_points
+        directly so every run draws fresh offsets. Runs with several workers do
+        too, so the page can drive its progress bar; Streamlit cannot replay
+        updates to an element created outside a cached function on a cache hit.
+
+        Args:
+            _data (pd.DataFrame): Input data. Not hashed by the cache.
+            fingerprint (str): Content hash of the upload (see utils.ingest.fingerprint), the cache key for _data.
+            radius, no_samp, plot_id_col, method, seed, distribution, min_offset, sigma: As in build_obfuscated_points.
+
+        Returns:
+            pd.DataFrame: One row per sample with plot_ID, lat and lon.
+        """
+        return build_obfuscated_points(_data, radius, no_samp, plot_id_col, method=method, seed=seed,
+            distribution=distribution, min_offset=min_offset, sigma=sigma)
+
 
 @st.cache_data
-def convert_for_download(df):
-    return df.to_csv().encode("utf-8")
+def convert_for_download(_df, cache_key):
+    # cache_key identifies _df (upload fingerprint plus parameters) so the frame is never hashed
+    return _df.to_csv().encode("utf-8")
 
 # Beginning of web app development
 st.set_page_config(page_title='Extract GEE Data from Coordinates', layout='wide')
@@ -121,22 +104,27 @@ col1, col2 = st.columns(2)
 
 
 with col1:
-    url = "https://raw.githubusercontent.com/opengeos/geospatial-data-catalogs/master/gee_catalog.json"
-
-    response = requests.get(url)
-    data = response.json()
-
-    data_dict = {item["id"]: item["url"] for item in data if "id" in item}
-    df = pd.DataFrame(list(data_dict.items()), columns=['id', 'url'])
-    geedata = st.selectbox('Optional: check resolution of Google Earth Engine dataset to determine appropriate buffer area.', df['id'])
-    url = data_dict.get(str(geedata))
+    catalog = get_catalog().index()
+    dataset_search = st.text_input('Search datasets', placeholder='e.g. landsat 8 toa', help='Narrows the dataset list to ids and titles with words starting with each search word.')
+    geedata = st.selectbox('Optional: check resolution of Google Earth Engine dataset to determine appropriate buffer area.', catalog.search(dataset_search))
+    entry = catalog.get(str(geedata))
+    url = entry.url if entry else None
 
     st.write('Dataset ID:', url)
+    if entry:
+        first_date, last_date = entry.date_range()
+        st.write('Date range:', f"{first_date or 'unknown'} to {last_date or 'unknown'}")
+        # Filled in by the extraction pages, which describe every dataset they load
+        metadata = get_metadata_cache().peek(entry.id)
+        if metadata and metadata['scale']:
+            st.write('Native resolution:', f"{metadata['scale']:g} m (about {metadata['scale'] * 3.28084:,.0f} ft)")
+        else:
+            st.write('Native resolution: see the dataset page above. It is shown here once the dataset has been used on an extraction page.')
 
 with col2:
     uploaded_file = st.file_uploader(
-        "Step 1: Upload a CSV file.",
-        type=["csv"],
+        "Step 1: Upload a CSV, Parquet, GeoParquet or Feather file.",
+        type=UPLOAD_TYPES,
         help="Double check that your CSV file is formatted correctly with LAT and LONG columns.")
     markdown = """
                 Accepted names for uploaded CSV file: \n
@@ -149,10 +137,31 @@ with col2:
                 [Example file](https://raw.githubusercontent.com/taraskiba/streamlit-skiba/refs/heads/main/sample_data/coordinate-point-formatting.csv)
                 """
     st.markdown(markdown)
+    invalid_rows = st.selectbox('Rows that fail validation', list(INVALID_ROW_ACTIONS), help='Rows with the wrong number of fields, missing or out-of-range coordinates, missing plot IDs or duplicate plot IDs are caught before any processing.')
 # Second row
 col1, col2, col3 = st.columns(3)
 with col1:
     buffer_distance = st.number_input('Step 3: Buffer Distance (in ft)', min_value=0, value=1000, step=1, key='buffer_distance)')
+    offset_methods = {'UTM projection': 'utm', 'Geodesic (WGS84)': 'geodesic'}
+    offset_method = st.selectbox('Offset method', list(offset_methods), help='Geodesic offsets skip the UTM projection and work in both hemispheres.')
+    reproducible = st.checkbox('Reproducible offsets', help='Generates a secret seed that reproduces the same obfuscated coordinates. Anyone holding the seed and the output can undo the obfuscation, so it is shown once and never written to the output.')
+    seed_text = ''
+    if reproducible:
+        seed_text = st.text_input('Optional: seed from an earlier run', type='password', help='The seed is a secret that undoes the obfuscation; keep it away from the output file. Leave blank to generate a new one.')
+    distributions = {
+        'Uniform over circle area': 'uniform',
+        'Uniform distance from center (legacy)': 'linear',
+        'Annulus (minimum offset)': 'annulus',
+        'Gaussian': 'gaussian',
+    }
+    distribution = st.selectbox('Sample distribution', list(distributions), help='Uniform over the circle area spreads samples evenly; the legacy option clusters them near the center.')
+    min_offset, sigma = 0, None
+    if distributions[distribution] == 'annulus':
+        min_offset = st.number_input('Minimum offset (in ft)', min_value=0, max_value=int(buffer_distance), value=0, step=1)
+    elif distributions[distribution] == 'gaussian':
+        sigma = st.number_input('Gaussian standard deviation (in ft)', min_value=1, value=max(int(buffer_distance) // 2, 1), step=1)
+    workers = st.number_input('Worker processes', min_value=1, max_value=os.cpu_count() or 1, value=1, step=1, help='Split large files across several processes.')
+    stream_output = st.checkbox('Stream large file', help='Read and write the file in chunks to keep memory use flat. Runs in a single process.')
 
 with col2:
     sample_size = st.number_input('Step 4: Number of samples to pull', min_value=0, value=5, step=1, key='sample_size)')
@@ -161,53 +170,111 @@ with col3:
     st.button("Reset", type="primary")
     if st.button("Run Query"):
         if uploaded_file is not None:
-            file_info = uploaded_file.getvalue()
-            points = pd.read_csv(io.BytesIO(file_info))
-
-            lat_cols = ['lat', 'latitude', 'y', 'LAT', 'Latitude', 'Lat','Y']
-            lon_cols = ['lon', 'long', 'longitude', 'x', 'LON', 'Longitude', 'Long', 'X']
-            id_cols = ['id', 'ID', 'plot_ID', 'plot_id', 'plotID', 'plotId']
-
-            def find_column(possible_names, columns):
-                for name in possible_names:
-                    if name in columns:
-                        return name
-                # fallback: check case-insensitive match
-                lower_columns = {c.lower(): c for c in columns}
-                for name in possible_names:
-                    if name.lower() in lower_columns:
-                        return lower_columns[name.lower()]
-                raise ValueError(f"No matching column found for {possible_names}")
-
-            lat_col = find_column(lat_cols, points.columns)
-            lon_col = find_column(lon_cols, points.columns)
-            id_col = find_column(id_cols, points.columns)
-
-            points = points.rename(columns={lat_col: 'LAT', lon_col: 'LON', id_col: 'plot_ID'})
-
-            if not geedata:
-                st.error("Please ensure all fields are filled out correctly.")
+            seed, seed_is_new = None, False
+            if reproducible and seed_text:
+                try:
+                    seed = parse_seed(seed_text)
+                except ValueError as e:
+                    st.error(str(e))
+                    st.stop()
+            elif reproducible:
+                seed, seed_is_new = new_seed(), True
+
+            if file_kind(uploaded_file.name) != 'csv':
+                stream_output = False  # Columnar files are read through Arrow instead
+
+            if stream_output:
+                # Only check the header; the rows are read and validated in chunks later
+                try:
+                    resolve_columns(read_header(uploaded_file))
+                except ValueError as e:
+                    st.error(f"Could not read {uploaded_file.name}: {e}")
+                    st.stop()
+                validator = ChunkValidator(uploaded_file)
+            else:
+                # Large uploads are parsed from a temp file instead of in memory
+                try:
+                    points = read_points(spill_upload(uploaded_file, st.session_state), uploaded_file.name)
+                except ValueError as e:
+                    st.error(f"Could not read {uploaded_file.name}: {e}")
+                    st.stop()
+                points = apply_validation(points, INVALID_ROW_ACTIONS[invalid_rows])
+            fingerprint = upload_fingerprint(uploaded_file, st.session_state)
+
+            progress_bar = st.progress(0.0, text="Obfuscating points...")
+            if stream_output:
+                csv = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+b")
+                plots = stream_obfuscated_csv(
+                    uploaded_file,
+                    csv,
+                    radius=buffer_distance,
+                    no_samp=sample_size,
+                    method=offset_methods[offset_method],
+                    seed=seed,
+                    distribution=distributions[distribution],
+                    min_offset=min_offset,
+                    sigma=sigma,
+                    validate=True,
+                    check=validator,
+                    progress=lambda rows: progress_bar.progress(
+                        min(uploaded_file.tell() / max(uploaded_file.size, 1), 1.0),
+                        text=f"{rows:,} plots obfuscated"
+                    )
+                )
+                # Invalid rows were left out as they were read; stopping withholds the download
+                report = validator.report()
+                report_invalid_rows(report, plots + len(report), INVALID_ROW_ACTIONS[invalid_rows])
+                # The download button needs the finished file as bytes
+                csv.seek(0)
+                csv = csv.read()
+            elif workers > 1 or seed is None:
+                # Not cached, so unseeded runs get fresh offsets and the bar can follow the chunks
+                returned_df = build_obfuscated_points(
+                    points,
+                    radius=buffer_distance,
+                    no_samp=sample_size,
+                    plot_id_col="plot_ID",
+                    method=offset_methods[offset_method],
+                    seed=seed,
+                    distribution=distributions[distribution],
+                    min_offset=min_offset,
+                    sigma=sigma,
+                    workers=workers,
+                    progress=progress_bar.progress
+                )
+                csv = returned_df.to_csv().encode("utf-8")
             else:
-                # convert date/time: pd.to_datetime('2024-12-31')
                 returned_df = obfuscate_points(
-                    data=points,
+                    _data=points,
+                    fingerprint=fingerprint,
                     radius=buffer_distance,
                     no_samp = sample_size,
-                    plot_id_col="plot_ID"
+                    plot_id_col="plot_ID",
+                    method=offset_methods[offset_method],
+                    seed=seed,
+                    distribution=distributions[distribution],
+                    min_offset=min_offset,
+                    sigma=sigma
                 )
-                file_name = f"buffered_coordinates_{buffer_distance}ft.csv"
-
-                csv = convert_for_download(returned_df)
-
-                if csv:
-                    st.success("Data extraction complete! You can download the results.")
-                    st.download_button(
-                        label="Download Results",
-                        data=csv,
-                        file_name=file_name
-                    )
-                else:
-                    st.error("No data extracted. Please check your inputs and try again.")
+                progress_bar.progress(1.0)
+                csv = convert_for_download(returned_df, cache_key=(fingerprint, buffer_distance, sample_size, offset_method, seed, distribution, min_offset, sigma))
+
+            # Never put the seed in the file name: with it the offsets can be recomputed and removed
+            file_name = f"buffered_coordinates_{buffer_distance}ft.csv"
+
+            if csv:
+                st.success("Data extraction complete! You can download the results.")
+                st.download_button(
+                    label="Download Results",
+                    data=csv,
+                    file_name=file_name,
+                    on_click="ignore"  # A rerun would drop the other download button
+                )
+                if seed_is_new:
+                    st.warning("Record this seed somewhere private to reproduce these results. It is shown only once, and anyone holding it can undo the obfuscation.")
+                    st.code(str(seed), language=None)
+            else:
+                st.error("No data extracted. Please check your inputs and try again.")
 
         else:
             st.error("Please upload a CSV file with LAT and LONG columns.")
@@ -1,15 +1,20 @@
 import streamlit as st
-import requests
 import pandas as pd
 import numpy as np
 import ee
 import geemap as gm
-import geopandas as gpd
 import io
 import datetime
+import time
 from google.oauth2 import service_account
 from ee import oauth
 import json
+from utils.catalog import get_catalog
+from utils.ee_metadata import get_metadata_cache
+from utils.extraction import extract_points
+from utils.ingest import INVALID_ROW_ACTIONS, UPLOAD_TYPES, apply_validation, read_points, spill_upload, upload_fingerprint
+from utils.jobs import DONE, FAILED, get_job_queue
+from utils.result_store import date_window, get_result_store
 
 # When running locally, use the following lines to authenticate and initialize Earth Engine
 #ee.Authenticate()  # Authenticate with Google Earth Engine when using locally
@@ -44,50 +49,32 @@ ee_initialize(force_use_service_account=True)
 
 
 @st.cache_data 
-def get_coordinate_data(data, geedata, start_date, end_date, **kwargs):
+def get_coordinate_data(_data, fingerprint, geedata, start_date, end_date, dedupe_pixels=False, reuse_results=False, **kwargs):
     """
     Pull data from provided coordinates from GEE.
 
     Args:
-        data (str): The data to get the coordinate data from.
+        _data (pd.DataFrame): LAT, LON and plot_ID columns, as returned by utils.ingest.read_points. Not hashed by the cache.
+        fingerprint (str): Content hash of the upload (see utils.ingest.fingerprint), the cache key for _data.
+        dedupe_pixels (bool): Sample each native pixel of the dataset once and copy its values to every point inside it.
+        reuse_results (bool): Read points sampled by earlier queries from the local result store and only send new ones.
 
     Returns:
-        data (str): CSV file contained GEE data.
+        pd.DataFrame: plot_ID, LAT and LON with the sampled GEE values.
     """
     
-    # Load data with safety checks
-    if isinstance(data, str):
-        coordinates = pd.read_csv(data)
-        gdf = gpd.GeoDataFrame(
-            coordinates,
-            geometry=gpd.points_from_xy(coordinates.LON, coordinates.LAT),
-            crs="EPSG:4326",  # Directly set CRS during creation
-        )
-    elif isinstance(data, pd.DataFrame):
-        coordinates = data
-        gdf = gpd.GeoDataFrame(
-            coordinates,
-            geometry=gpd.points_from_xy(coordinates.LON, coordinates.LAT),
-            crs="EPSG:4326",  # Directly set CRS during creation
-        )
-    else:
-        gdf = data.to_crs(epsg=4326)  # Ensure WGS84
-        
-
-    geojson = gdf.__geo_interface__
-    fc = gm.geojson_to_ee(geojson)
-    
     dataset_id = f"{geedata}"
 
     # Load the GEE dataset as an image
-    geeimage = load_gee_as_image(dataset_id=dataset_id, start_date=start_date, end_date=end_date)
+    geeimage, metadata = load_gee_as_image(dataset_id=dataset_id, start_date=start_date, end_date=end_date)
 
     # Retrieve data from the image using sampleRegions
-    sampled_data = gm.extract_values_to_points(fc, geeimage, scale = None)
-    
-    return sampled_data
+    store, store_key = None, None
+    if reuse_results:
+        # Keyed like load_gee_as_image builds the image: dataset, date window and median compositing
+        store, store_key = get_result_store(), (dataset_id, date_window(start_date, end_date), "median")
+    return extract_points(geeimage, _data, store=store, key=store_key, dedupe_pixels=dedupe_pixels, metadata=metadata)
 
-@st.cache_data
 def load_gee_as_image(dataset_id, start_date, end_date, **kwargs):
     """
     Loads any GEE dataset (Image, ImageCollection, FeatureCollection) as an ee.Image.
@@ -99,24 +86,18 @@ def load_gee_as_image(dataset_id, start_date, end_date, **kwargs):
         end_date (str): Optional end date in 'YYYY-MM-DD' format.
 
     Returns:
-        ee.Image: The resulting image.
+        tuple: The resulting ee.Image and its metadata (bands, types, native scale and grid),
+            from the persistent cache in utils.ee_metadata.
     """
-    url = "https://raw.githubusercontent.com/opengeos/geospatial-data-catalogs/master/gee_catalog.json"
-    response = requests.get(url)
-    response.raise_for_status()  # Raises an exception for HTTP errors
-    geojson_data = response.json()
-
-    data_type =[item["type"] for item in geojson_data if item["id"]==dataset_id]
-    data_str = ' '.join(data_type)
+    entry = get_catalog().index().get(dataset_id)
+    data_str = entry.type if entry else ""
     start_date = str(start_date)
     end_date = str(end_date)
 
     # Try loading as Image
     if data_str == "image":
         img = ee.Image(dataset_id)
-        # If .getInfo() doesn't throw, it's an Image
-        img.getInfo()
-        return img
+        metadata_key = dataset_id
     elif data_str == "image_collection":
         col = ee.ImageCollection(dataset_id)
         # If date filters are provided, apply them
@@ -126,7 +107,7 @@ def load_gee_as_image(dataset_id, start_date, end_date, **kwargs):
             pass
         # Reduce to a single image (e.g., median composite)
         img = col.median()
-        return img
+        metadata_key = f"{dataset_id}|{start_date}|{end_date}"
     # Try loading as FeatureCollection (convert to raster)
     else:
         fc_temp = ee.FeatureCollection(dataset_id)
@@ -134,17 +115,26 @@ def load_gee_as_image(dataset_id, start_date, end_date, **kwargs):
                 fc_temp = fc_temp.filterDate(start_date, end_date)
         # Convert to raster: burn a value of 1 into a new image
         img = fc_temp.reduceToImage(properties=[], reducer=ee.Reducer.median())
-        img.getInfo()
-        return img
-        # or print(f"Dataset must be either an Image or Image Collection")
-        # except Exception:
-        #     raise ValueError(
-        #         "Dataset ID is not a valid Image, ImageCollection, or FeatureCollection."
-        #     )
+        metadata_key = f"{dataset_id}|{start_date}|{end_date}"
+
+    # Validated against the persistent metadata cache instead of a getInfo() on every query
+    metadata = get_metadata_cache().get(metadata_key, img)
+    if not metadata["valid"]:
+        raise ValueError(f"Dataset {dataset_id} could not be loaded: {metadata['error']}")
+    return img, metadata
+
+@st.fragment(run_every=2)
+def poll_extraction_job(job_id):
+    job = get_job_queue().status(job_id)
+    if job is None or job['status'] in (DONE, FAILED):
+        st.rerun()  # Full rerun to show the result and stop polling
+    elapsed = time.time() - job['submitted_at']
+    st.info(f"Extraction {job['status']} for {elapsed:.0f} s. You can reload this page; the link keeps track of the job.")
 
 @st.cache_data
-def convert_df(df):
-    return df.to_csv().encode("utf-8")
+def convert_df(_df, cache_key):
+    # cache_key identifies _df (upload fingerprint plus query) so the frame is never hashed
+    return _df.to_csv().encode("utf-8")
 
 # Beginning of web app development
 st.set_page_config(page_title='Extract GEE Data from Coordinates', layout='wide')
@@ -177,8 +167,8 @@ col1, col2 = st.columns(2)
 
 with col1:
     uploaded_file = st.file_uploader(
-        "Step 1: Upload a CSV file.",
-        type=["csv"],
+        "Step 1: Upload a CSV, Parquet, GeoParquet or Feather file.",
+        type=UPLOAD_TYPES,
         help="Double check that your CSV file is formatted correctly with accepted latitude and longitude columns.")
     markdown = """
                 Accepted names for uploaded CSV file: \n
@@ -191,85 +181,85 @@ with col1:
                 [Example file](https://raw.githubusercontent.com/taraskiba/streamlit-skiba/refs/heads/main/sample_data/coordinate-point-formatting.csv)
                 """
     st.markdown(markdown)
+    invalid_rows = st.selectbox('Rows that fail validation', list(INVALID_ROW_ACTIONS), help='Rows with the wrong number of fields, missing or out-of-range coordinates or missing plot IDs are caught before any processing.')
 with col2:
-    url = "https://raw.githubusercontent.com/opengeos/geospatial-data-catalogs/master/gee_catalog.json"
-
-    response = requests.get(url)
-    data = response.json()
-
-    data_dict = {item["id"]: item["url"] for item in data if "id" in item}
-    df = pd.DataFrame(list(data_dict.items()), columns=['id', 'url'])
-    geedata = st.selectbox('Step 2: Select a GEE dataset', df['id'])
-    url = data_dict.get(str(geedata))
+    catalog = get_catalog().index()
+    dataset_search = st.text_input('Search datasets', placeholder='e.g. landsat 8 toa', help='Narrows the dataset list to ids and titles with words starting with each search word.')
+    geedata = st.selectbox('Step 2: Select a GEE dataset', catalog.search(dataset_search))
+    entry = catalog.get(str(geedata))
+    url = entry.url if entry else None
     st.write('Image and ImageCollections only!')
     st.write('Dataset ID:', url)
-    geedata = str(geedata)
-    geedata_stripped = geedata.strip()
+    # None when the search matches no dataset, which the Run Query check rejects
+    geedata_stripped = str(geedata).strip()
     file_name = geedata_stripped.replace("/", "_")
     st.write('Your file will be downloaded under the following name:', file_name,'.csv')
 
 # Second row
 col1, col2, col3 = st.columns(3)
 with col1:
-    start_date = st.date_input('Start Date', value=None, min_value=datetime.date(1800,1,1))
+    # Bounded by the dates the catalog lists for the dataset
+    first_date, last_date = entry.date_range() if entry else (None, None)
+    start_date = st.date_input('Start Date', value=None, min_value=first_date or datetime.date(1800,1,1), help=f"The dataset covers {first_date or 'unknown'} to {last_date or 'unknown'}.")
 
 with col2:
-    end_date = st.date_input('End Date', value=None, min_value=datetime.date(1800,1,1))
+    end_date = st.date_input('End Date', value=None, min_value=first_date or datetime.date(1800,1,1), help=f"The dataset covers {first_date or 'unknown'} to {last_date or 'unknown'}.")
+    if start_date and last_date and start_date > last_date:
+        st.warning(f"The catalog lists no data for this dataset after {last_date}; the query may return nothing.")
+    reuse_results = st.checkbox('Reuse earlier results', value=True, help='Points already sampled from the same dataset and dates, in any session, are read from the local result store instead of Earth Engine. Stored values expire after 30 days, or after an hour while the date window may still gain new scenes.')
+    dedupe_pixels = st.checkbox('Sample each pixel once', help='Points that fall in the same pixel of the dataset are sent to Earth Engine once. Speeds up buffered files on coarse datasets without changing the results.')
 
 with col3:
     st.button("Reset", type="primary")
     if st.button("Run Query"):
         if uploaded_file is not None:
-            file_info = uploaded_file.getvalue()
-            points = pd.read_csv(io.BytesIO(file_info))
-
-            lat_cols = ['lat', 'latitude', 'y', 'LAT', 'Latitude', 'Lat', 'Y']
-            lon_cols = ['lon', 'long', 'longitude', 'x', 'LON', 'Longitude', 'Long', 'X']
-            id_cols = ['id', 'ID', 'plot_ID', 'plot_id', 'plotID', 'plotId']
-
-            def find_column(possible_names, columns):
-                for name in possible_names:
-                    if name in columns:
-                        return name
-                # fallback: check case-insensitive match
-                lower_columns = {c.lower(): c for c in columns}
-                for name in possible_names:
-                    if name.lower() in lower_columns:
-                        return lower_columns[name.lower()]
-                raise ValueError(f"No matching column found for {possible_names}")
-
-            lat_col = find_column(lat_cols, points.columns)
-            lon_col = find_column(lon_cols, points.columns)
-            id_col = find_column(id_cols, points.columns)
-
-            points = points.rename(columns={lat_col: 'LAT', lon_col: 'LON', id_col: 'plot_ID'})
+            # Large uploads are parsed from a temp file instead of in memory
+            try:
+                points = read_points(spill_upload(uploaded_file, st.session_state), uploaded_file.name)
+            except ValueError as e:
+                st.error(f"Could not read {uploaded_file.name}: {e}")
+                st.stop()
+            points = apply_validation(points, INVALID_ROW_ACTIONS[invalid_rows], allow_duplicate_ids=True)
+            fingerprint = upload_fingerprint(uploaded_file, st.session_state)
 
             if not geedata:
                 st.error("Please ensure all fields are filled out correctly.")
             else:
-                # convert date/time: pd.to_datetime('2024-12-31') 
-                returned_dataset = get_coordinate_data(
-                    data=points, geedata=geedata, start_date=start_date, end_date=end_date
+                # The extraction runs in the background; the job ID is kept in the URL so a reload can find it.
+                # The job's sampling is utils.extraction.extract_points, which benchmarks/bench_jobs.py runs offline
+                job_id = get_job_queue().submit(
+                    get_coordinate_data, points, fingerprint, geedata, start_date, end_date, dedupe_pixels, reuse_results,
+                    key=(fingerprint, geedata, start_date, end_date, dedupe_pixels, reuse_results),
+                    label=file_name
                 )
-                
-                returned_df = gm.ee_to_df(returned_dataset)
-                id_col = returned_df.pop('plot_ID')
-                returned_df.insert(0, 'plot_ID', id_col)  # Insert at the beginning
-                returned_df = returned_df.drop(returned_df.columns[[3]], axis = 1)
-                returned_csv = convert_df(returned_df)
-
-                if returned_csv:
-                    st.success("Data extraction complete! You can download the results.")
-                    st.download_button(
-                        label="Download Results",
-                        data=returned_csv,
-                        mime="text/csv",
-                        file_name=f"{file_name}.csv"
-                    )
-                else:
-                    st.error("No data extracted. Please check your inputs and try again.")
+                st.session_state['extraction_job'] = job_id
+                st.query_params['job'] = job_id
                     
         else:
-            st.error("Please upload a CSV file with LAT and LONG columns.")    
+            st.error("Please upload a CSV file with LAT and LONG columns.")
+
+    job_id = st.session_state.get('extraction_job') or st.query_params.get('job')
+    if job_id:
+        job = get_job_queue().status(job_id)
+        if job is None:
+            st.warning("This extraction is no longer available. Please run the query again.")
+            st.session_state.pop('extraction_job', None)
+            st.query_params.pop('job', None)
+        elif job['status'] == FAILED:
+            st.error(f"Extraction failed: {job['error']}")
+        elif job['status'] == DONE:
+            returned_csv = convert_df(job['result'], cache_key=job_id)
+            if returned_csv:
+                st.success("Data extraction complete! You can download the results.")
+                st.download_button(
+                    label="Download Results",
+                    data=returned_csv,
+                    mime="text/csv",
+                    file_name=f"{job['label']}.csv"
+                )
+            else:
+                st.error("No data extracted. Please check your inputs and try again.")
+        else:
+            poll_extraction_job(job_id)    
         
      
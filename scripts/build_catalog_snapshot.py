@@ -0,0 +1,64 @@
+"""
+Build the compact GEE catalog snapshot bundled with the app.
+
+Downloads gee_catalog.json (or reads a local copy), keeps only the fields
+the pages use and writes them as a zstd-compressed Parquet file. The app
+loads this snapshot on a cold start and refreshes it from GitHub in the
+background, so rerun this script before a release to keep it recent and
+commit the result. Where GitHub is unreachable, the source can also be
+the ee_data_catalog.csv table shipped in the geemap package
+(geemap/data/template/ee_data_catalog.csv).
+
+Usage:
+    python scripts/build_catalog_snapshot.py
+    python scripts/build_catalog_snapshot.py --source gee_catalog.json --output data/gee_catalog.parquet
+    python scripts/build_catalog_snapshot.py --source ee_data_catalog.csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from utils.catalog import CATALOG_URL, SNAPSHOT_PATH, compact_items, snapshot_bytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--source",
+        default=CATALOG_URL,
+        help="URL or path of gee_catalog.json, or path of geemap's ee_data_catalog.csv",
+    )
+    parser.add_argument("--output", default=SNAPSHOT_PATH)
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.source):
+        with open(args.source, "rb") as f:
+            raw = f.read()
+    else:
+        response = requests.get(args.source, timeout=60)
+        response.raise_for_status()
+        raw = response.content
+
+    if args.source.lower().endswith(".csv"):
+        items = compact_items(csv.DictReader(io.StringIO(raw.decode("utf-8"))))
+    else:
+        items = compact_items(json.loads(raw))
+    data = snapshot_bytes(items)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "wb") as f:
+        f.write(data)
+    print(
+        f"{len(items)} datasets, {len(raw) / 2**20:.1f} MiB source -> {len(data) / 2**20:.2f} MiB {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
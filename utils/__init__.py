@@ -0,0 +1 @@
+"""Shared helpers used by the pages of the streamlit-skiba app."""
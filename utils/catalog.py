@@ -0,0 +1,391 @@
+import bisect
+import datetime
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import NamedTuple
+
+import requests
+import streamlit as st
+
+CATALOG_URL = "https://raw.githubusercontent.com/opengeos/geospatial-data-catalogs/master/gee_catalog.json"
+
+# Where the last good copy of the catalog is kept between restarts
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "streamlit-skiba")
+
+# Compact copy shipped with the app, built by scripts/build_catalog_snapshot.py
+SNAPSHOT_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "data",
+    "gee_catalog.parquet",
+)
+
+# Seconds before a cached copy is revalidated against GitHub
+CATALOG_TTL = 6 * 60 * 60
+
+# Seconds to wait for GitHub before keeping the cached copy
+FETCH_TIMEOUT = 10
+
+
+class CatalogEntry(NamedTuple):
+    """One dataset of the catalog, with the fields the app uses."""
+
+    id: str
+    title: str
+    type: str
+    url: str
+    start_date: str = None
+    end_date: str = None
+
+    def date_range(self):
+        """
+        The dates the dataset covers.
+
+        Returns:
+            tuple: (start, end) as datetime.date, either None when the
+                catalog does not give it.
+        """
+        return _date_or_none(self.start_date), _date_or_none(self.end_date)
+
+
+def write_atomic(path, data):
+    """
+    Write bytes next to path and rename them into place, so readers never see a partial file.
+
+    Args:
+        path (str): Destination file; its directory is created if needed.
+        data (bytes): File contents.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def compact_items(items):
+    """
+    Keep only the catalog fields the app uses.
+
+    Args:
+        items (iterable): Entries as parsed from gee_catalog.json, or rows of
+            geemap's ee_data_catalog.csv, which names the url asset_url.
+
+    Returns:
+        list: One dict per entry with an id, holding the CatalogEntry fields.
+    """
+    return [
+        {
+            "id": item["id"],
+            "title": item.get("title") or "",
+            "type": item.get("type") or "",
+            "url": item.get("url") or item.get("asset_url") or "",
+            "start_date": item.get("start_date") or None,
+            "end_date": item.get("end_date") or None,
+        }
+        for item in items
+        if "id" in item
+    ]
+
+
+def snapshot_bytes(items):
+    """
+    Serialize the compact catalog as a zstd-compressed Parquet file.
+
+    Args:
+        items (list): Entries as returned by compact_items.
+
+    Returns:
+        bytes: The Parquet file.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ("id", pa.string()),
+            ("title", pa.string()),
+            ("type", pa.string()),
+            ("url", pa.string()),
+            ("start_date", pa.string()),
+            ("end_date", pa.string()),
+        ]
+    )
+    buffer = io.BytesIO()
+    pq.write_table(
+        pa.Table.from_pylist(items, schema=schema), buffer, compression="zstd"
+    )
+    return buffer.getvalue()
+
+
+def read_snapshot(path):
+    """
+    Read a compact catalog written by snapshot_bytes.
+
+    Args:
+        path (str): Path of the Parquet snapshot.
+
+    Returns:
+        list: One dict per entry, as returned by compact_items.
+    """
+    import pyarrow.parquet as pq
+
+    return pq.read_table(path).to_pylist()
+
+
+def _date_or_none(value):
+    # Catalog dates are ISO dates, sometimes with a time after them
+    try:
+        return datetime.date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def _tokens(text):
+    return {t for t in re.split(r"[^0-9a-z]+", text.lower()) if t}
+
+
+class CatalogIndex:
+    """
+    Catalog entries indexed for lookup by id and for type-ahead search.
+
+    Lookups by id go through a dict. Search matches every query word against
+    the words of the dataset ids and titles by prefix, using a sorted word
+    list and bisect, so typing narrows the list without scanning the catalog.
+    """
+
+    def __init__(self, items):
+        entries = [CatalogEntry(**item) for item in compact_items(items)]
+        self.entries = tuple(entries)
+        self.ids = tuple(entry.id for entry in entries)
+        self._by_id = {entry.id: entry for entry in entries}
+
+        postings = {}
+        for position, entry in enumerate(entries):
+            for token in _tokens(entry.id) | _tokens(entry.title):
+                postings.setdefault(token, []).append(position)
+        self._words = sorted(postings)
+        self._postings = [postings[word] for word in self._words]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, dataset_id):
+        """
+        Look up a dataset by id.
+
+        Args:
+            dataset_id (str): The Earth Engine dataset ID.
+
+        Returns:
+            CatalogEntry or None: The entry, or None when the id is not in the catalog.
+        """
+        return self._by_id.get(dataset_id)
+
+    def search(self, query, limit=None):
+        """
+        Dataset ids whose id or title has a word starting with each word of the query.
+
+        Args:
+            query (str): Free text, e.g. "landsat 8 toa".
+            limit (int, optional): Maximum number of ids to return.
+
+        Returns:
+            tuple: Matching ids in catalog order; every id for an empty query.
+        """
+        matches = None
+        for token in _tokens(query):
+            start = bisect.bisect_left(self._words, token)
+            stop = bisect.bisect_left(self._words, token + "\uffff", lo=start)
+            positions = set()
+            for posting in self._postings[start:stop]:
+                positions.update(posting)
+            matches = positions if matches is None else matches & positions
+            if not matches:
+                return ()
+        if matches is None:
+            return self.ids[:limit]
+        return tuple(self.ids[position] for position in sorted(matches)[:limit])
+
+
+class CatalogService:
+    """
+    Process-wide copy of the GEE catalog, persisted to disk as a compact snapshot.
+
+    The catalog is loaded once per process, from the last good copy in the
+    cache directory or else from the snapshot bundled with the app. After the
+    TTL (immediately for the bundled snapshot) it is revalidated with a
+    conditional GET (ETag / If-Modified-Since) on a background thread, so
+    callers keep getting the current copy while GitHub is asked for a new
+    one. When GitHub is unreachable the last good copy stays in use. Only a
+    start with neither copy on disk waits for the download.
+    """
+
+    def __init__(
+        self,
+        url=CATALOG_URL,
+        cache_dir=CACHE_DIR,
+        ttl=CATALOG_TTL,
+        timeout=FETCH_TIMEOUT,
+        snapshot_path=SNAPSHOT_PATH,
+    ):
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout
+        self.snapshot_path = snapshot_path
+        self.path = os.path.join(cache_dir, "gee_catalog.parquet")
+        self.meta_path = os.path.join(cache_dir, "gee_catalog.meta.json")
+        # _lock guards the in-memory copy and is never held during a download;
+        # _fetch_lock lets only one download run at a time
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+        self._items = None
+        self._index = None
+        self._meta = {}
+        self.last_error = None
+
+    def items(self):
+        """
+        Get the catalog entries.
+
+        Returns:
+            list: Catalog entries with the fields kept by compact_items.
+        """
+        with self._lock:
+            if self._items is None:
+                self._load_from_disk()
+            items = self._items
+            start_refresh = (
+                items is not None and self._is_stale() and not self._refreshing
+            )
+            if start_refresh:
+                self._refreshing = True
+
+        if items is None:
+            # Nothing cached yet; this first download has to block, once
+            with self._fetch_lock:
+                with self._lock:
+                    items = self._items
+                if items is None:
+                    self._fetch()
+                    with self._lock:
+                        items = self._items
+            if items is None:
+                raise RuntimeError(
+                    f"Could not download the GEE catalog: {self.last_error}"
+                )
+        elif start_refresh:
+            threading.Thread(target=self.refresh, daemon=True).start()
+        return items
+
+    def index(self):
+        """
+        Get the catalog as a CatalogIndex, rebuilt only when the catalog changes.
+
+        Returns:
+            CatalogIndex: The indexed catalog.
+        """
+        items = self.items()
+        with self._lock:
+            if self._index is None or self._index[0] is not items:
+                self._index = (items, CatalogIndex(items))
+            return self._index[1]
+
+    def refresh(self):
+        """Revalidate the catalog with GitHub now, keeping the current copy on failure."""
+        with self._fetch_lock:
+            try:
+                self._fetch()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+    def stats(self):
+        """Return when the catalog was last checked and the last fetch error, if any."""
+        with self._lock:
+            return {
+                "checked_at": self._meta.get("checked_at"),
+                "etag": self._meta.get("etag"),
+                "entries": len(self._items or ()),
+                "last_error": self.last_error,
+            }
+
+    def _is_stale(self):
+        return time.time() - self._meta.get("checked_at", 0) > self.ttl
+
+    def _load_from_disk(self):
+        for path in (self.path, self.snapshot_path):
+            try:
+                self._items = read_snapshot(path)
+                break
+            except (OSError, ValueError):
+                # Missing or unreadable copy; the next fetch replaces it
+                continue
+        try:
+            with open(self.meta_path) as f:
+                self._meta = json.load(f)
+        except (OSError, ValueError):
+            self._meta = {}
+        if path != self.path:
+            # The bundled snapshot is revalidated on first use
+            self._meta = {}
+
+    def _fetch(self):
+        with self._lock:
+            meta = dict(self._meta)
+            have_copy = self._items is not None
+        headers = {}
+        if have_copy:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        items = None
+        try:
+            response = requests.get(self.url, headers=headers, timeout=self.timeout)
+            response.raise_for_status()
+            if response.status_code != 304:
+                items = compact_items(response.json())
+                self._write(self.path, snapshot_bytes(items))
+                meta = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+            error = None
+        except (requests.RequestException, ValueError) as e:
+            error = str(e)
+
+        # A failed check also waits a full TTL rather than retrying on every rerun
+        meta["checked_at"] = time.time()
+        with self._lock:
+            self.last_error = error
+            if items is not None:
+                self._items = items
+            if error is None or self._items is not None:
+                self._meta = meta
+        if error is None:
+            self._write(self.meta_path, json.dumps(meta).encode("utf-8"))
+
+    @staticmethod
+    def _write(path, data):
+        # The disk copy is only a fallback, so a read-only disk is not an error
+        try:
+            write_atomic(path, data)
+        except OSError:
+            pass
+
+
+@st.cache_resource
+def get_catalog():
+    """Shared CatalogService, reused across reruns and sessions."""
+    return CatalogService()
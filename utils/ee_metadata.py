@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+import time
+
+import streamlit as st
+
+from utils.catalog import CACHE_DIR, write_atomic
+from utils.scheduler import is_retryable, scheduled
+
+# Seconds a dataset's metadata is trusted before it is fetched again
+METADATA_TTL = 7 * 24 * 60 * 60
+
+# Datasets that failed to load are retried sooner, in case the failure was temporary
+INVALID_TTL = 60 * 60
+
+
+def describe_image(image):
+    """
+    Fetch the metadata the pipeline uses for an image in one round trip.
+
+    Args:
+        image (ee.Image): The image to describe.
+
+    Returns:
+        dict: valid, error, bands (names), types (precision of each band),
+            scale (nominal scale of the first band in meters), crs and
+            transform (grid of the first band). An image Earth Engine cannot
+            load is reported with valid False and the error message; throttles
+            and transient failures are raised instead, so they are not cached.
+    """
+    import ee
+
+    try:
+        info = ee.Dictionary(
+            {
+                "image": image,
+                "scale": image.select(0).projection().nominalScale(),
+            }
+        ).getInfo()
+    except ee.EEException as error:
+        if is_retryable(error):
+            raise
+        return {
+            "valid": False,
+            "error": str(error),
+            "bands": [],
+            "types": [],
+            "scale": None,
+            "crs": None,
+            "transform": None,
+        }
+
+    bands = info["image"].get("bands", [])
+    first = bands[0] if bands else {}
+    return {
+        "valid": True,
+        "error": None,
+        "bands": [band["id"] for band in bands],
+        "types": [band.get("data_type", {}).get("precision") for band in bands],
+        "scale": info["scale"],
+        "crs": first.get("crs"),
+        "transform": first.get("crs_transform"),
+    }
+
+
+class MetadataCache:
+    """
+    Earth Engine metadata per dataset, kept in memory and in a JSON file.
+
+    Entries expire after the TTL, or INVALID_TTL for datasets that failed to
+    load. Lookups never hold the lock while Earth Engine is queried, so
+    concurrent extractions only wait on each other for the dictionary.
+    """
+
+    def __init__(
+        self,
+        path=os.path.join(CACHE_DIR, "ee_metadata.json"),
+        ttl=METADATA_TTL,
+        invalid_ttl=INVALID_TTL,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.invalid_ttl = invalid_ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        try:
+            with open(path) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, key, image, describe=scheduled(describe_image)):
+        """
+        Get the metadata of a dataset, describing the image on a miss.
+
+        Args:
+            key (str): Identifies the dataset, including any date filter
+                that changes the image.
+            image (ee.Image): The image to describe on a miss.
+            describe (callable): Fetches the metadata of an image; defaults to
+                describe_image run through the shared request scheduler.
+
+        Returns:
+            dict: The metadata, as returned by describe_image, plus checked_at.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                ttl = self.ttl if entry["valid"] else self.invalid_ttl
+                if now - entry["checked_at"] <= ttl:
+                    self.hits += 1
+                    return entry
+            self.misses += 1
+
+        entry = dict(describe(image), checked_at=now)
+        with self._lock:
+            self._entries[key] = entry
+            data = json.dumps(self._entries).encode("utf-8")
+        try:
+            write_atomic(self.path, data)
+        except OSError:
+            pass  # The in-memory copy still serves this process
+        return entry
+
+    def peek(self, dataset_id):
+        """
+        The freshest unexpired metadata of a dataset, without querying Earth Engine.
+
+        Image collections are cached per date window, so every window of the
+        dataset is considered.
+
+        Args:
+            dataset_id (str): The Earth Engine dataset ID.
+
+        Returns:
+            dict or None: The metadata, as returned by get, or None when no
+                valid entry of the dataset is cached.
+        """
+        now = time.time()
+        with self._lock:
+            entries = [
+                entry
+                for key, entry in self._entries.items()
+                if (key == dataset_id or key.startswith(f"{dataset_id}|"))
+                and entry["valid"]
+                and now - entry["checked_at"] <= self.ttl
+            ]
+        return max(entries, key=lambda entry: entry["checked_at"], default=None)
+
+    def stats(self):
+        """Return hit/miss counts and number of cached datasets."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "datasets": len(self._entries),
+            }
+
+
+@st.cache_resource
+def get_metadata_cache():
+    """Shared MetadataCache, reused across reruns and sessions."""
+    return MetadataCache()
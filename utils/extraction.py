@@ -0,0 +1,470 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from pyproj import CRS
+from pyproj.exceptions import CRSError
+
+from utils.result_store import coordinate_keys
+from utils.scheduler import get_scheduler
+from utils.transformers import get_transformer_registry
+
+# Property carrying the pixel number of each deduplicated point through Earth Engine
+PIXEL_COLUMN = "pixel_ID"
+
+# Property carrying the number of each new coordinate through Earth Engine
+COORDINATE_COLUMN = "coordinate_ID"
+
+# Points per request; getInfo refuses collections of more than 5000 elements
+EXTRACT_BATCH_SIZE = 5000
+
+# Requests in flight at once
+EXTRACT_WORKERS = 4
+
+
+def pixel_index(lon, lat, crs, transform):
+    """
+    Column and row of the pixel containing each point on an affine grid.
+
+    Args:
+        lon (array-like): Longitudes in WGS84.
+        lat (array-like): Latitudes in WGS84.
+        crs (str): CRS of the grid, as reported by ee.Projection (EPSG code or WKT).
+        transform (sequence): Affine transform of the grid in Earth Engine order,
+            [xScale, xShearing, xTranslation, yShearing, yScale, yTranslation].
+
+    Returns:
+        np.ndarray: (n, 2) integer array of pixel columns and rows.
+    """
+    x = np.asarray(lon, dtype="float64")
+    y = np.asarray(lat, dtype="float64")
+    if CRS.from_user_input(crs) != CRS.from_epsg(4326):
+        to_grid, _ = get_transformer_registry().get("EPSG:4326", crs)
+        x, y = to_grid.transform(x, y)
+
+    a, b, c, d, e, f = transform
+    det = a * e - b * d
+    x = x - c
+    y = y - f
+    col = (e * x - b * y) / det
+    row = (a * y - d * x) / det
+    return np.stack([np.floor(col), np.floor(row)], axis=1).astype("int64")
+
+
+def dedupe_by_pixel(lon, lat, crs, transform):
+    """
+    Pick one point per occupied pixel.
+
+    Args:
+        lon (array-like): Longitudes in WGS84.
+        lat (array-like): Latitudes in WGS84.
+        crs (str): CRS of the grid.
+        transform (sequence): Affine transform of the grid, as in pixel_index.
+
+    Returns:
+        tuple: (first, inverse). first holds the position of one point in each
+            unique pixel; inverse holds, for every point, the number of its
+            pixel, so values sampled at first can be fanned out with values[inverse].
+    """
+    keys = pixel_index(lon, lat, crs, transform)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    return first, inverse.reshape(-1)
+
+
+def image_grid(image, metadata=None):
+    """
+    Grid Earth Engine samples an image on when no scale is given.
+
+    sampleRegions uses the projection of the image's first band, so that is
+    the grid points are snapped to.
+
+    Args:
+        image (ee.Image): The image to sample.
+        metadata (dict, optional): Cached metadata of the image (see
+            utils.ee_metadata); its crs and transform save the round trip.
+
+    Returns:
+        tuple or None: (crs, transform), or None when the projection cannot
+            be read by pyproj.
+    """
+    if metadata is not None:
+        crs, transform = metadata.get("crs"), metadata.get("transform")
+    else:
+        info = get_scheduler().call(image.select(0).projection().getInfo)
+        crs = info.get("crs") or info.get("wkt")
+        transform = info.get("transform")
+    if crs is None or transform is None:
+        return None
+    try:
+        CRS.from_user_input(crs)
+    except CRSError:
+        return None
+    return crs, transform
+
+
+class GeemapBackend:
+    """
+    Earth Engine calls made through geemap and the ee client; the default backend.
+
+    Backends are passed to the extraction functions so that
+    benchmarks/fake_ee.py can stand in for Earth Engine offline.
+    """
+
+    def geojson_to_ee(self, geojson):
+        import geemap as gm
+
+        return gm.geojson_to_ee(geojson)
+
+    def extract_values_to_points(self, fc, image, scale=None):
+        import geemap as gm
+
+        return gm.extract_values_to_points(fc, image, scale=scale)
+
+    def ee_to_df(self, fc):
+        import geemap as gm
+
+        return gm.ee_to_df(fc)
+
+    def band_names(self, image):
+        return image.bandNames().getInfo()
+
+    def group_mean(self, fc, bands, group_column):
+        """
+        Mean of each band over the features of each group, computed in Earth Engine.
+
+        Returns:
+            pd.DataFrame: One row per group, indexed by group_column, one column per band.
+        """
+        import ee
+
+        reducer = (
+            ee.Reducer.mean()
+            .repeat(len(bands))
+            .group(groupField=len(bands), groupName=group_column)
+        )
+        groups = (
+            fc.reduceColumns(reducer=reducer, selectors=list(bands) + [group_column])
+            .get("groups")
+            .getInfo()
+        )
+        return pd.DataFrame(
+            [group["mean"] for group in groups],
+            index=pd.Index(
+                [group[group_column] for group in groups], name=group_column
+            ),
+            columns=list(bands),
+        )
+
+
+class ScheduledBackend:
+    """
+    Backend whose Earth Engine round trips go through a RequestScheduler.
+
+    Only the calls that reach the server (ee_to_df, band_names and
+    group_mean) are scheduled; building the lazy collections is local. The
+    round trips only read data, so they are retried after throttles and
+    transient failures.
+
+    Args:
+        backend: The backend to wrap, e.g. GeemapBackend or the offline fake.
+        scheduler (RequestScheduler, optional): Defaults to the shared scheduler.
+    """
+
+    def __init__(self, backend, scheduler=None):
+        self.backend = backend
+        self.scheduler = scheduler
+
+    def geojson_to_ee(self, geojson):
+        return self.backend.geojson_to_ee(geojson)
+
+    def extract_values_to_points(self, fc, image, scale=None):
+        return self.backend.extract_values_to_points(fc, image, scale=scale)
+
+    def ee_to_df(self, fc):
+        return self._call(self.backend.ee_to_df, fc)
+
+    def band_names(self, image):
+        return self._call(self.backend.band_names, image)
+
+    def group_mean(self, fc, bands, group_column):
+        return self._call(self.backend.group_mean, fc, bands, group_column)
+
+    def _call(self, fn, *args):
+        return (self.scheduler or get_scheduler()).call(fn, *args)
+
+
+DEFAULT_BACKEND = ScheduledBackend(GeemapBackend())
+
+
+def _map_batches(fn, batches, workers):
+    # Run fn over the batches with up to workers in flight; results keep the batch order
+    if workers <= 1 or len(batches) <= 1:
+        return [fn(batch) for batch in batches]
+    with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+        # map yields in submission order, whatever order the batches finish in
+        return list(pool.map(fn, batches))
+
+
+def _sample_batch(image, gdf, backend):
+    fc = backend.geojson_to_ee(gdf.__geo_interface__)
+    return backend.ee_to_df(backend.extract_values_to_points(fc, image, scale=None))
+
+
+def sample_in_batches(
+    image, gdf, batch_size=EXTRACT_BATCH_SIZE, workers=EXTRACT_WORKERS, backend=None
+):
+    """
+    Sample an image at every point, in bounded batches sent concurrently.
+
+    Each batch is its own extract_values_to_points / ee_to_df round trip, so
+    no single request exceeds Earth Engine's element limit, and up to
+    workers requests are in flight at once. The batch results are
+    concatenated in input order.
+
+    Args:
+        image (ee.Image): The image to sample at its native scale.
+        gdf (gpd.GeoDataFrame): Points in WGS84 with their attribute columns.
+        batch_size (int): Points per request.
+        workers (int): Maximum number of requests in flight.
+        backend (GeemapBackend, optional): Earth Engine calls to use. Defaults
+            to geemap; benchmarks/fake_ee.py offers an offline stand-in.
+
+    Returns:
+        pd.DataFrame: One row per sampled point, in input order.
+    """
+    backend = backend or DEFAULT_BACKEND
+    batches = [
+        gdf.iloc[start : start + batch_size] for start in range(0, len(gdf), batch_size)
+    ]
+    frames = _map_batches(
+        partial(_sample_batch, image, backend=backend), batches, workers
+    )
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def sample_points(
+    image,
+    gdf,
+    dedupe_pixels=False,
+    batch_size=EXTRACT_BATCH_SIZE,
+    workers=EXTRACT_WORKERS,
+    backend=None,
+    metadata=None,
+):
+    """
+    Sample an image at every point of a GeoDataFrame.
+
+    Args:
+        image (ee.Image): The image to sample at its native scale.
+        gdf (gpd.GeoDataFrame): Points in WGS84 with their attribute columns.
+        dedupe_pixels (bool): Send one point per native pixel of the image and
+            copy its values to every point in the same pixel. The result is the
+            same as sampling every point, but the request shrinks by the
+            number of points per pixel.
+        batch_size (int): Points per request, see sample_in_batches.
+        workers (int): Maximum number of requests in flight.
+        backend (GeemapBackend, optional): Earth Engine calls, see sample_in_batches.
+        metadata (dict, optional): Cached metadata of the image, used for its grid.
+
+    Returns:
+        pd.DataFrame: The attribute columns of every sampled point followed by
+            the image bands. Points over masked pixels are dropped, as by
+            sampleRegions.
+    """
+    sample = partial(
+        sample_in_batches, batch_size=batch_size, workers=workers, backend=backend
+    )
+    grid = image_grid(image, metadata) if dedupe_pixels else None
+    if grid is None:
+        return sample(image, gdf)
+
+    first, inverse = dedupe_by_pixel(gdf.geometry.x, gdf.geometry.y, *grid)
+    pixels = gdf.iloc[first][[gdf.geometry.name]].assign(
+        **{PIXEL_COLUMN: np.arange(len(first))}
+    )
+    values = sample(image, pixels)
+    if PIXEL_COLUMN not in values:
+        # Every pixel was masked
+        return pd.DataFrame(gdf.drop(columns=gdf.geometry.name)).iloc[:0]
+
+    attributes = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+    attributes[PIXEL_COLUMN] = inverse
+    sampled = attributes.join(
+        values.set_index(PIXEL_COLUMN), on=PIXEL_COLUMN, how="inner"
+    )
+    return sampled.drop(columns=PIXEL_COLUMN).reset_index(drop=True)
+
+
+def sample_points_incremental(image, gdf, store, key, **sampling):
+    """
+    Sample an image at every point, requesting only coordinates not sampled before.
+
+    Coordinates are matched after rounding (see utils.result_store), so
+    repeated points are also requested once. The new results, including
+    points over masked pixels, are saved to the store for later queries.
+
+    Args:
+        image (ee.Image): The image to sample at its native scale.
+        gdf (gpd.GeoDataFrame): Points in WGS84 with their attribute columns.
+        store (ResultStore): Where earlier results are kept.
+        key (tuple): (dataset, date_window, method) identifying the image.
+        **sampling: Passed on to sample_points for the new coordinates.
+
+    Returns:
+        pd.DataFrame: The same rows and columns as sample_points.
+    """
+    lon = gdf.geometry.x.to_numpy()
+    lat = gdf.geometry.y.to_numpy()
+    lon_keys, lat_keys = coordinate_keys(lon, lat)
+    _, first, inverse = np.unique(
+        np.stack([lon_keys, lat_keys], axis=1),
+        axis=0,
+        return_index=True,
+        return_inverse=True,
+    )
+    known = store.lookup(key, lon[first], lat[first])
+
+    missing = np.setdiff1d(
+        np.arange(len(first)), np.fromiter(known, dtype="int64", count=len(known))
+    )
+    if len(missing):
+        new_points = gdf.iloc[first[missing]][[gdf.geometry.name]].assign(
+            **{COORDINATE_COLUMN: missing}
+        )
+        sampled = sample_points(image, new_points, **sampling)
+        records = {}
+        if COORDINATE_COLUMN in sampled:
+            values = sampled.set_index(COORDINATE_COLUMN).astype(object)
+            records = values.where(values.notna(), None).to_dict("index")
+        fresh = [records.get(number) for number in missing.tolist()]
+        store.store(key, lon[first[missing]], lat[first[missing]], fresh)
+        known.update(zip(missing.tolist(), fresh))
+
+    values = pd.DataFrame.from_dict(
+        {number: v for number, v in known.items() if v is not None}, orient="index"
+    )
+    attributes = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+    attributes[COORDINATE_COLUMN] = inverse.reshape(-1)
+    sampled = attributes.join(values, on=COORDINATE_COLUMN, how="inner")
+    return sampled.drop(columns=COORDINATE_COLUMN).reset_index(drop=True)
+
+
+def extract_points(image, points, store=None, key=None, **sampling):
+    """
+    Sample an image at uploaded plots; the work of a point extraction job.
+
+    Pages load the image and submit this to utils.jobs.JobQueue. With a
+    backend from benchmarks/fake_ee.py it runs without Earth Engine.
+
+    Args:
+        image (ee.Image): The image to sample at its native scale.
+        points (pd.DataFrame): LAT, LON and plot_ID columns, as returned by
+            utils.ingest.read_points.
+        store (ResultStore, optional): Reuse and keep earlier results, see
+            sample_points_incremental.
+        key (tuple, optional): Identifies the image in the store.
+        **sampling: Passed on to sample_points, e.g. dedupe_pixels, metadata
+            or backend.
+
+    Returns:
+        pd.DataFrame: plot_ID, then LAT, LON and the image bands of every
+            sampled point.
+    """
+    gdf = gpd.GeoDataFrame(
+        points,
+        geometry=gpd.points_from_xy(points.LON, points.LAT),
+        crs="EPSG:4326",
+    )
+    if store is not None:
+        sampled = sample_points_incremental(image, gdf, store, key, **sampling)
+    else:
+        sampled = sample_points(image, gdf, **sampling)
+    # plot_ID first and the rest in order, also for the empty frame of an empty upload
+    return sampled[sorted(sampled.columns, key=lambda column: column != "plot_ID")]
+
+
+def plot_batches(plot_ids, batch_size):
+    """
+    Split point positions into batches of about batch_size that never split a plot.
+
+    Args:
+        plot_ids (array-like): Plot ID of every point.
+        batch_size (int): Target number of points per batch.
+
+    Returns:
+        list: Arrays of point positions, one per batch.
+    """
+    codes, _ = pd.factorize(np.asarray(plot_ids), use_na_sentinel=False)
+    order = np.argsort(codes, kind="stable")
+    if len(order) == 0:
+        return []
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    # Cut at the first plot starting at or after each multiple of batch_size
+    targets = np.arange(batch_size, len(order), batch_size)
+    cuts = np.unique(
+        starts[np.minimum(np.searchsorted(starts, targets), len(starts) - 1)]
+    )
+    return np.split(order, cuts[cuts > 0])
+
+
+def _aggregate_batch(image, gdf, bands, id_column, backend):
+    fc = backend.extract_values_to_points(
+        backend.geojson_to_ee(gdf.__geo_interface__), image, scale=None
+    )
+    return backend.group_mean(fc, bands, id_column)
+
+
+def aggregate_points(
+    image,
+    gdf,
+    id_column="plot_ID",
+    batch_size=EXTRACT_BATCH_SIZE,
+    workers=EXTRACT_WORKERS,
+    backend=None,
+    metadata=None,
+):
+    """
+    Mean of the image bands over the sampled points of each plot, reduced in Earth Engine.
+
+    The points are sampled as by sample_points, then grouped by plot with a
+    grouped mean reducer before anything is downloaded, so only one row per
+    plot crosses the wire. The result equals sampling every point and taking
+    groupby(id_column, observed=True).mean() locally. Batches hold whole plots and run
+    concurrently as in sample_in_batches.
+
+    Args:
+        image (ee.Image): The image to sample at its native scale.
+        gdf (gpd.GeoDataFrame): Points in WGS84 with a plot ID column.
+        id_column (str): Column identifying the plot of each point.
+        batch_size (int): Approximate points per request.
+        workers (int): Maximum number of requests in flight.
+        backend (GeemapBackend, optional): Earth Engine calls, see sample_in_batches.
+        metadata (dict, optional): Cached metadata of the image; its band
+            names save the round trip.
+
+    Returns:
+        pd.DataFrame: One row per plot with at least one unmasked sample,
+            indexed by plot ID and sorted like a pandas groupby, one column per band.
+    """
+    backend = backend or DEFAULT_BACKEND
+    bands = metadata["bands"] if metadata is not None else backend.band_names(image)
+    points = gdf[[id_column, gdf.geometry.name]]
+    batches = [
+        points.iloc[positions]
+        for positions in plot_batches(points[id_column], batch_size)
+    ]
+    frames = _map_batches(
+        partial(
+            _aggregate_batch, image, bands=bands, id_column=id_column, backend=backend
+        ),
+        batches,
+        workers,
+    )
+    if not frames:
+        return pd.DataFrame(columns=bands, index=pd.Index([], name=id_column))
+    return pd.concat(frames).sort_index()
@@ -0,0 +1,620 @@
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import tempfile
+import weakref
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+try:
+    import pyarrow  # noqa: F401
+
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
+
+# Accepted names for the uploaded columns, in order of preference
+LAT_COLUMNS = ["lat", "latitude", "y", "LAT", "Latitude", "Lat", "Y"]
+LON_COLUMNS = ["lon", "long", "longitude", "x", "LON", "Longitude", "Long", "X"]
+ID_COLUMNS = ["id", "ID", "plot_ID", "plot_id", "plotID", "plotId"]
+
+# File types accepted by the upload widgets, and the reader used for each
+UPLOAD_TYPES = ["csv", "parquet", "geoparquet", "feather", "arrow"]
+FILE_KINDS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".geoparquet": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+}
+
+# Bytes hashed per read when fingerprinting file-like sources
+FINGERPRINT_BLOCK_SIZE = 2**20
+
+# Uploads at least this large are written to a temp file and read from disk
+SPILL_THRESHOLD = 64 * 2**20
+
+# Choices offered by the pages for rows that fail validate_points
+INVALID_ROW_ACTIONS = {
+    "Stop and show the report": "stop",
+    "Drop invalid rows": "drop",
+    "Quarantine invalid rows to a separate file": "quarantine",
+}
+
+
+def fingerprint(source):
+    """
+    Content hash of an upload, used as the cache key for everything derived from it.
+
+    Args:
+        source (bytes, str, file-like): File contents, path or file object.
+            File-like sources are hashed in blocks and rewound afterwards.
+
+    Returns:
+        str: Hex digest of the contents.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    elif isinstance(source, io.BytesIO):
+        # Hash the buffer in place instead of copying it with getvalue()
+        with source.getbuffer() as view:
+            digest.update(view)
+    elif isinstance(source, str):
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(FINGERPRINT_BLOCK_SIZE), b""):
+                digest.update(block)
+    else:
+        for block in iter(lambda: source.read(FINGERPRINT_BLOCK_SIZE), b""):
+            digest.update(block)
+        source.seek(0)
+    return digest.hexdigest()
+
+
+def upload_fingerprint(uploaded_file, cache=None):
+    """
+    Fingerprint a Streamlit UploadedFile once per upload.
+
+    Args:
+        uploaded_file (UploadedFile): The uploaded file.
+        cache (MutableMapping, optional): Where to keep fingerprints between
+            reruns, e.g. st.session_state. Entries are keyed by the upload's file_id.
+
+    Returns:
+        str: Hex digest of the upload contents.
+    """
+    key = f"fingerprint:{uploaded_file.file_id}"
+    if cache is not None and key in cache:
+        return cache[key]
+    digest = fingerprint(uploaded_file)
+    if cache is not None:
+        cache[key] = digest
+    return digest
+
+
+class SpilledUpload:
+    """
+    Temp file copy of an upload, removed once nothing refers to it.
+
+    Keep the instance (e.g. in st.session_state) for as long as the path is used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._finalizer = weakref.finalize(self, _remove_file, path)
+
+    def remove(self):
+        self._finalizer()
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def spill_upload(uploaded_file, cache=None, threshold=SPILL_THRESHOLD):
+    """
+    Write a large upload to disk once so it can be parsed through a memory map.
+
+    The copy is made block by block from the upload's buffer, and the upload
+    is fingerprinted in the same pass, so upload_fingerprint needs no second
+    read. Uploads smaller than the threshold are returned unchanged.
+
+    Args:
+        uploaded_file (UploadedFile): The uploaded file.
+        cache (MutableMapping, optional): Where to keep the temp file between
+            reruns, e.g. st.session_state. Entries are keyed by the upload's
+            file_id; spilling a new upload drops the previous one, and the file
+            is deleted with its entry. Without a cache the file lives as long
+            as the uploaded_file object.
+        threshold (int): Size in bytes from which uploads are spilled.
+
+    Returns:
+        str or UploadedFile: Path of the temp file, or the upload itself.
+    """
+    if uploaded_file.size < threshold:
+        return uploaded_file
+    key = f"spill:{uploaded_file.file_id}"
+    if cache is not None:
+        if key in cache:
+            return cache[key].path
+        for stale in [k for k in cache.keys() if str(k).startswith("spill:")]:
+            cache[stale].remove()
+            del cache[stale]
+
+    digest = hashlib.blake2b(digest_size=16)
+    suffix = os.path.splitext(uploaded_file.name)[1]
+    with tempfile.NamedTemporaryFile(
+        suffix=suffix, prefix="upload-", delete=False
+    ) as f:
+        spilled = SpilledUpload(f.name)
+        with uploaded_file.getbuffer() as view:
+            for start in range(0, len(view), FINGERPRINT_BLOCK_SIZE):
+                block = view[start : start + FINGERPRINT_BLOCK_SIZE]
+                digest.update(block)
+                f.write(block)
+    if cache is not None:
+        cache[key] = spilled
+        cache[f"fingerprint:{uploaded_file.file_id}"] = digest.hexdigest()
+    else:
+        weakref.finalize(uploaded_file, spilled.remove)
+    return spilled.path
+
+
+def find_column(possible_names, columns):
+    """
+    Find the first of the possible names in columns.
+
+    Args:
+        possible_names (list): Accepted names, in order of preference.
+        columns (iterable): Column names of the uploaded file.
+
+    Returns:
+        str: The matching column name.
+    """
+    for name in possible_names:
+        if name in columns:
+            return name
+    # fallback: check case-insensitive match
+    lower_columns = {c.lower(): c for c in columns}
+    for name in possible_names:
+        if name.lower() in lower_columns:
+            return lower_columns[name.lower()]
+    raise ValueError(f"No matching column found for {possible_names}")
+
+
+def resolve_columns(columns):
+    """
+    Map the uploaded latitude, longitude and plot ID columns to LAT, LON and plot_ID.
+
+    Args:
+        columns (iterable): Column names of the uploaded file.
+
+    Returns:
+        dict: Rename mapping from the uploaded names to LAT, LON and plot_ID.
+    """
+    return {
+        find_column(LAT_COLUMNS, columns): "LAT",
+        find_column(LON_COLUMNS, columns): "LON",
+        find_column(ID_COLUMNS, columns): "plot_ID",
+    }
+
+
+def read_header(source):
+    """
+    Read only the column names of a CSV.
+
+    File-like sources are rewound afterwards so they can be read again.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    columns = pd.read_csv(source, nrows=0).columns
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return columns
+
+
+def file_kind(file_name):
+    """
+    Reader to use for an uploaded file, based on its extension.
+
+    Args:
+        file_name (str): Name or path of the file. Unknown extensions are read as CSV.
+
+    Returns:
+        str: "csv", "parquet" or "feather".
+    """
+    return FILE_KINDS.get(os.path.splitext(str(file_name))[1].lower(), "csv")
+
+
+def read_points(source, file_name=None):
+    """
+    Read plot coordinates from an uploaded CSV, Parquet, GeoParquet or Feather file.
+
+    For CSV only the header is read to resolve the column aliases; then just
+    the latitude, longitude and plot ID columns are parsed with the pyarrow
+    CSV engine. Files it rejects, e.g. for ragged rows or non-numeric
+    coordinates, and all files when pyarrow is missing, are read row by row
+    instead: every row is kept, unparsable coordinates become NaN and rows
+    with the wrong number of fields are marked for validate_points. Parquet
+    and Feather/Arrow IPC files are loaded as Arrow tables with only those
+    columns, so no text is parsed and floats keep their exact values. LAT and
+    LON are float64 and plot_ID is categorical. Paths, e.g. from
+    spill_upload, are parsed through a memory map.
+
+    Args:
+        source (bytes, str, file-like): File contents, path or file object.
+        file_name (str, optional): Name used to pick the reader. Defaults to
+            the source's name attribute, or the path itself.
+
+    Returns:
+        pd.DataFrame: Frame with LAT, LON and plot_ID columns.
+    """
+    if file_name is None:
+        file_name = source if isinstance(source, str) else getattr(source, "name", "")
+    kind = file_kind(file_name)
+    if kind != "csv":
+        return _read_table_points(source, kind)
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    rename = resolve_columns(read_header(source))
+    if CSV_ENGINE != "pyarrow":
+        return _read_csv_records(source)
+    lat_col, lon_col, id_col = rename
+    kwargs = dict(
+        usecols=list(rename),
+        dtype={lat_col: "float64", lon_col: "float64", id_col: "category"},
+    )
+    try:
+        if isinstance(source, str):
+            import pyarrow as pa
+
+            with pa.memory_map(source) as mapped:
+                points = pd.read_csv(mapped, engine=CSV_ENGINE, **kwargs)
+        else:
+            points = pd.read_csv(source, engine=CSV_ENGINE, **kwargs)
+    except ValueError:
+        # Ragged rows (e.g. trailing commas) or non-numeric coordinates; read
+        # every row as text so validate_points can report them per row
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return _read_csv_records(source)
+    return points.rename(columns=rename)[["LAT", "LON", "plot_ID"]]
+
+
+def iter_csv_points(source, chunk_rows):
+    """
+    Read plot coordinates from a CSV in chunks of rows.
+
+    Every chunk is indexed by row position in the file and has LAT, LON and
+    plot_ID columns, with unparsable coordinates as NaN and plot IDs as text,
+    so an ID compares equal whichever chunk it is in. Files with rows of
+    the wrong number of fields, e.g. from trailing commas, are read row by
+    row so those rows keep their place and are marked for validate_points;
+    a quick pyarrow scan spares well-formed files that slower read.
+
+    Args:
+        source (bytes, str, file-like): File contents, path or file object.
+        chunk_rows (int): Rows per chunk.
+
+    Yields:
+        pd.DataFrame: The next chunk of rows.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    rename = resolve_columns(read_header(source))
+    lat_col, lon_col, id_col = rename
+    if CSV_ENGINE != "pyarrow" or _has_malformed_rows(source, lat_col):
+        yield from _iter_csv_records(source, chunk_rows)
+        return
+    for chunk in pd.read_csv(
+        source, chunksize=chunk_rows, usecols=list(rename), dtype={id_col: str}
+    ):
+        for column in (lat_col, lon_col):
+            chunk[column] = pd.to_numeric(chunk[column], errors="coerce").astype(
+                "float64"
+            )
+        yield chunk.rename(columns=rename)[["LAT", "LON", "plot_ID"]]
+
+
+def validate_points(points, allow_duplicate_ids=False, duplicate_ids=None):
+    """
+    Check every row of an upload before it is sent anywhere.
+
+    All checks run as whole-column operations in one pass over the frame.
+
+    Args:
+        points (pd.DataFrame): Frame with LAT, LON and plot_ID columns.
+        allow_duplicate_ids (bool): Whether repeated plot IDs are expected,
+            e.g. for buffered files with several samples per plot.
+        duplicate_ids (set, optional): Plot IDs repeated anywhere in the
+            file, for a frame that is only one chunk of it; every row with
+            one of them is reported as a duplicate.
+
+    Returns:
+        pd.DataFrame: One row per invalid input row, indexed like points, with
+            the row's plot_ID, LAT, LON and a semicolon separated list of errors.
+            Empty when every row is valid.
+    """
+    # Views of the float64 columns; nothing is copied for the checks
+    lat = np.asarray(points["LAT"], dtype="float64")
+    lon = np.asarray(points["LON"], dtype="float64")
+    missing_id = points["plot_ID"].isna().to_numpy()
+    checks = {
+        # Marked by read_points and iter_csv_points
+        "wrong number of fields": points.index.isin(points.attrs.get("malformed", [])),
+        "missing or non-numeric coordinate": np.isnan(lat) | np.isnan(lon),
+        "missing plot ID": missing_id,
+        "latitude and longitude look swapped": (np.abs(lat) > 90) & (np.abs(lon) <= 90),
+        "latitude out of range": np.abs(lat) > 90,
+        "longitude out of range": np.abs(lon) > 180,
+    }
+    if not allow_duplicate_ids:
+        duplicated = points["plot_ID"].duplicated(keep=False).to_numpy()
+        if duplicate_ids:
+            duplicated = duplicated | points["plot_ID"].isin(duplicate_ids).to_numpy()
+        checks["duplicate plot ID"] = duplicated & ~missing_id
+
+    bad = np.logical_or.reduce(list(checks.values()))
+    report = points.loc[bad, ["plot_ID", "LAT", "LON"]].copy()
+    errors = pd.Series("", index=report.index)
+    for message, failed in checks.items():
+        errors = errors.where(~failed[bad], errors + message + "; ")
+    report["errors"] = errors.str.rstrip("; ")
+    return report
+
+
+class ChunkValidator:
+    """
+    validate_points for a CSV read in chunks, e.g. by stream_obfuscated_csv.
+
+    Unless duplicates are allowed, the plot ID column is read once up front to
+    find the IDs that occur more than once. Every row with one of them is then
+    reported, as apply_validation does for a file read whole, so the rows kept
+    do not depend on where the chunk boundaries fall.
+
+    Args:
+        source (bytes, str, file-like): The CSV that will be read in chunks.
+            File-like sources are rewound after the scan.
+        allow_duplicate_ids (bool): Whether repeated plot IDs are expected.
+    """
+
+    def __init__(self, source, allow_duplicate_ids=False):
+        self.allow_duplicate_ids = allow_duplicate_ids
+        self.duplicate_ids = set()
+        if not allow_duplicate_ids:
+            self.duplicate_ids = _duplicate_ids(source)
+        self.reports = []
+
+    def __call__(self, chunk):
+        """Validate the next chunk and return its invalid rows."""
+        report = validate_points(chunk, self.allow_duplicate_ids, self.duplicate_ids)
+        self.reports.append(report)
+        return report
+
+    def report(self):
+        """The invalid rows of all chunks so far, in file order."""
+        if not self.reports:
+            return pd.DataFrame(columns=["plot_ID", "LAT", "LON", "errors"])
+        return pd.concat(self.reports)
+
+
+def report_invalid_rows(report, n_rows, action):
+    """
+    Show the invalid rows of an upload and carry out the chosen action.
+
+    Args:
+        report (pd.DataFrame): Invalid rows, as returned by validate_points.
+        n_rows (int): Number of rows in the upload.
+        action (str): "stop" ends the script run, "quarantine" offers the
+            rows for download and "drop" only reports them. The download
+            button does not rerun the script, so any results offered for
+            download next to it must not either (on_click="ignore").
+    """
+    if report.empty:
+        return
+    st.warning(f"{len(report)} of {n_rows} rows failed validation.")
+    st.dataframe(report)
+    if action == "stop":
+        st.stop()
+    if action == "quarantine":
+        st.download_button(
+            label="Download Invalid Rows",
+            data=report.to_csv().encode("utf-8"),
+            file_name="invalid_rows.csv",
+            # Downloading must not rerun the page, or the results would be lost
+            on_click="ignore",
+        )
+
+
+def apply_validation(points, action, allow_duplicate_ids=False):
+    """
+    Validate an upload, report its invalid rows and leave them out.
+
+    Args:
+        points (pd.DataFrame): Frame with LAT, LON and plot_ID columns.
+        action (str): "stop", "drop" or "quarantine", see report_invalid_rows.
+        allow_duplicate_ids (bool): Whether repeated plot IDs are expected.
+
+    Returns:
+        pd.DataFrame: points without the invalid rows.
+    """
+    report = validate_points(points, allow_duplicate_ids)
+    report_invalid_rows(report, len(points), action)
+    return points.drop(index=report.index)
+
+
+def _duplicate_ids(source):
+    # Plot IDs occurring more than once, from one pass over the file in chunks
+    seen, repeated = set(), set()
+    for chunk in iter_csv_points(source, 2**20):
+        ids = chunk["plot_ID"].dropna()
+        repeated.update(ids[ids.duplicated() | ids.isin(seen)])
+        seen.update(ids)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return repeated
+
+
+def _has_malformed_rows(source, column):
+    # Parses a single column, but pyarrow still checks every row's field count
+    import pyarrow as pa
+    import pyarrow.csv as pcsv
+
+    options = pcsv.ConvertOptions(
+        include_columns=[column], column_types={column: pa.string()}
+    )
+    try:
+        for _ in pcsv.open_csv(source, convert_options=options):
+            pass
+    except pa.ArrowInvalid:
+        return True
+    finally:
+        if hasattr(source, "seek"):
+            source.seek(0)
+    return False
+
+
+def _read_csv_records(source):
+    # The whole file through _iter_csv_records, keeping the malformed row marks
+    chunks = list(_iter_csv_records(source, 2**20))
+    if not chunks:
+        return pd.DataFrame({"LAT": [], "LON": [], "plot_ID": []}).astype(
+            {"LAT": "float64", "LON": "float64", "plot_ID": "category"}
+        )
+    points = pd.concat(chunks).astype({"plot_ID": "category"})
+    points.attrs["malformed"] = [i for c in chunks for i in c.attrs["malformed"]]
+    return points
+
+
+def _iter_csv_records(source, chunk_rows):
+    # Row by row with the csv module, which unlike the pandas parsers keeps
+    # rows with too many or too few fields, at their position in the file
+    if isinstance(source, str):
+        f = open(source, newline="", encoding="utf-8-sig")
+    else:
+        f = io.TextIOWrapper(source, newline="", encoding="utf-8-sig")
+    try:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        positions = list(resolve_columns(header))
+        positions = [header.index(column) for column in positions]
+        start = 0
+        while True:
+            batch = list(itertools.islice(reader, chunk_rows))
+            if not batch:
+                break
+            records = [record for record in batch if record]  # Skip blank lines
+            if not records:
+                continue
+            index = pd.RangeIndex(start, start + len(records))
+            lat, lon, ids = (
+                pd.Series(column, index=index, dtype="object")
+                for column in zip(
+                    *([r[i] if i < len(r) else "" for i in positions] for r in records)
+                )
+            )
+            chunk = pd.DataFrame(
+                {
+                    "LAT": pd.to_numeric(lat, errors="coerce").astype("float64"),
+                    "LON": pd.to_numeric(lon, errors="coerce").astype("float64"),
+                    "plot_ID": ids.where(ids != ""),
+                }
+            )
+            chunk.attrs["malformed"] = [
+                start + i for i, r in enumerate(records) if len(r) != len(header)
+            ]
+            yield chunk
+            start += len(records)
+    finally:
+        if isinstance(source, str):
+            f.close()
+        else:
+            f.detach()  # Leave the upload open for the caller
+
+
+def _read_table_points(source, kind):
+    # Parquet / GeoParquet / Feather (Arrow IPC) uploads, read through Arrow
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = pa.BufferReader(source)
+    elif isinstance(source, str):
+        source = pa.memory_map(source)
+
+    if kind == "parquet":
+        schema = pq.read_schema(source)
+        source.seek(0)
+        if schema.metadata and b"geo" in schema.metadata:
+            return _read_geoparquet_points(source, schema)
+        rename = resolve_columns(schema.names)
+        table = pq.read_table(source, columns=list(rename))
+    else:
+        try:
+            names = pa.ipc.open_file(source).schema.names
+        except pa.ArrowInvalid:
+            # Arrow IPC streams and Feather v1 files have no IPC file footer,
+            # so their columns cannot be read on their own
+            source.seek(0)
+            table = _read_unfooted_ipc(source)
+            rename = resolve_columns(table.column_names)
+            table = table.select(list(rename))
+        else:
+            rename = resolve_columns(names)
+            source.seek(0)
+            table = feather.read_table(source, columns=list(rename))
+
+    # One block per column lets pandas wrap the Arrow buffers without consolidating
+    points = table.to_pandas(split_blocks=True, self_destruct=True).rename(
+        columns=rename
+    )
+    return points.astype({"LAT": "float64", "LON": "float64", "plot_ID": "category"})[
+        ["LAT", "LON", "plot_ID"]
+    ]
+
+
+def _read_unfooted_ipc(source):
+    # Whole Arrow IPC stream, or else a whole Feather v1 file
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    try:
+        return pa.ipc.open_stream(source).read_all()
+    except pa.ArrowInvalid:
+        source.seek(0)
+    try:
+        return feather.read_table(source)
+    except pa.ArrowInvalid:
+        raise ValueError(
+            "Feather and Arrow uploads must be Feather (v1 or v2) or Arrow IPC files."
+        ) from None
+
+
+def _read_geoparquet_points(source, schema):
+    # Coordinates come from the primary point geometry instead of LAT/LON columns
+    import geopandas as gpd
+
+    geometry_col = json.loads(schema.metadata[b"geo"])["primary_column"]
+    id_col = find_column(ID_COLUMNS, [c for c in schema.names if c != geometry_col])
+    gdf = gpd.read_parquet(source, columns=[id_col, geometry_col])
+    if gdf.crs is not None:
+        gdf = gdf.to_crs(epsg=4326)  # Ensure WGS84
+    if not (gdf.geom_type == "Point").all():
+        raise ValueError("GeoParquet uploads must contain point geometries.")
+    return pd.DataFrame(
+        {
+            "LAT": gdf.geometry.y.to_numpy(),
+            "LON": gdf.geometry.x.to_numpy(),
+            "plot_ID": pd.Categorical(gdf[id_col]),
+        }
+    )
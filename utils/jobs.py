@@ -0,0 +1,130 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+# Extractions running at once across all sessions
+JOB_WORKERS = 4
+
+# Seconds a finished job and its result are kept for the page to collect
+JOB_TTL = 60 * 60
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """
+    Process-wide queue of long-running work, run on a background thread pool.
+
+    Pages submit a function and get a job ID back straight away, then poll
+    status() on later reruns and collect the result once the job is done.
+    Jobs do not belong to a session, so a reloaded tab can pick its job up
+    again by ID. Jobs submitted with the same key share one run while it is
+    queued, running or kept after finishing.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, ttl=JOB_TTL):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="job"
+        )
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._keys = {}
+
+    def submit(self, fn, *args, key=None, label=None, **kwargs):
+        """
+        Queue fn(*args, **kwargs) and return its job ID.
+
+        Args:
+            fn (callable): The work to run. Its return value is the job result.
+            key (hashable, optional): Identifies the work; a live job with the
+                same key is reused instead of starting another.
+            label (str, optional): Description of the work for the page to show.
+
+        Returns:
+            str: The job ID.
+        """
+        with self._lock:
+            self._expire()
+            if key is not None and key in self._keys:
+                job_id = self._keys[key]
+                if self._jobs[job_id]["status"] != FAILED:
+                    return job_id
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": QUEUED,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+                "key": key,
+                "label": label,
+            }
+            if key is not None:
+                self._keys[key] = job_id
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def status(self, job_id):
+        """
+        Get a snapshot of a job.
+
+        Args:
+            job_id (str): ID returned by submit.
+
+        Returns:
+            dict or None: The job's status, timestamps, result and error, or
+                None when the ID is unknown or has expired.
+        """
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def stats(self):
+        """Return the number of jobs in each status."""
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status=RUNNING, started_at=time.time())
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as error:
+            self._update(
+                job_id,
+                status=FAILED,
+                error=f"{type(error).__name__}: {error}",
+                finished_at=time.time(),
+            )
+        else:
+            self._update(job_id, status=DONE, result=result, finished_at=time.time())
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _expire(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job["finished_at"] is not None and now - job["finished_at"] > self.ttl:
+                del self._jobs[job_id]
+                if self._keys.get(job["key"]) == job_id:
+                    del self._keys[job["key"]]
+
+
+@st.cache_resource
+def get_job_queue():
+    """Shared JobQueue, reused across reruns and sessions."""
+    return JobQueue()
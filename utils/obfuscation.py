@@ -0,0 +1,608 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Geod
+
+from utils.ingest import iter_csv_points
+from utils.transformers import get_transformer_registry
+
+WGS84_GEOD = Geod(ellps="WGS84")
+
+# Offset distance distributions supported by sample_distances
+DISTRIBUTIONS = ("uniform", "linear", "annulus", "gaussian")
+
+# Rows per independent random stream when a seed is given
+RNG_BLOCK_SIZE = 4096
+
+# Target number of output points per chunk in obfuscate_in_chunks
+CHUNK_POINTS = 2**20
+
+# Output kept in memory before a spooled download file rolls over to disk
+SPOOL_MAX_SIZE = 32 * 2**20
+
+# Smallest seed accepted from users; anything shorter can be guessed
+MIN_SEED_BITS = 64
+
+
+def new_seed():
+    """
+    High-entropy seed for a reproducible obfuscation run.
+
+    The seed together with an output file is enough to recompute every offset
+    and recover the original coordinates, so it must be kept secret and never
+    written into the output.
+
+    Returns:
+        int: A 128-bit seed from the operating system's entropy source.
+    """
+    return np.random.SeedSequence().entropy
+
+
+def parse_seed(text):
+    """
+    Parse a seed recorded from an earlier run.
+
+    Args:
+        text (str): The seed as typed by the user.
+
+    Raises:
+        ValueError: If the text is not a whole number of at least MIN_SEED_BITS bits.
+
+    Returns:
+        int: The seed.
+    """
+    try:
+        seed = int(text.strip())
+    except ValueError:
+        raise ValueError("The seed must be a whole number.") from None
+    if seed.bit_length() < MIN_SEED_BITS:
+        raise ValueError(
+            "The seed is too short to keep the offsets secret; "
+            "leave it blank to generate a new one."
+        )
+    return seed
+
+
+def random_uniform(n_rows, per_row, seed=None, start=0):
+    """
+    Uniform [0, 1) draws for rows start .. start + n_rows of an input.
+
+    With a seed, rows are grouped in fixed blocks of RNG_BLOCK_SIZE and every
+    block draws from its own numpy Generator, spawned from SeedSequence(seed)
+    by block index. A given row therefore always gets the same numbers, so the
+    rows can be split into chunks and processed in any order (or in different
+    processes) with bit-identical results. Without a seed, fresh entropy is used.
+
+    Args:
+        n_rows (int): Number of rows to draw for.
+        per_row (int): Number of draws per row.
+        seed (int, optional): Seed for reproducible draws.
+        start (int): Index of the first row within the whole input.
+
+    Returns:
+        np.ndarray: Array of shape (n_rows, per_row).
+    """
+    if seed is None:
+        return np.random.default_rng().random((n_rows, per_row))
+
+    out = np.empty((n_rows, per_row))
+    stop = start + n_rows
+    for block in range(start // RNG_BLOCK_SIZE, -(-stop // RNG_BLOCK_SIZE)):
+        block_start = block * RNG_BLOCK_SIZE
+        rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(block,)))
+        draws = rng.random((RNG_BLOCK_SIZE, per_row))
+        lo = max(start, block_start)
+        hi = min(stop, block_start + RNG_BLOCK_SIZE)
+        out[lo - start : hi - start] = draws[lo - block_start : hi - block_start]
+    return out
+
+
+def utm_epsg(lon, lat):
+    """
+    EPSG code of the WGS84 UTM zone containing each point.
+
+    Args:
+        lon (array-like): Longitudes in decimal degrees.
+        lat (array-like): Latitudes in decimal degrees.
+
+    Returns:
+        np.ndarray: 326xx codes for the northern hemisphere, 327xx for the southern.
+    """
+    lon = np.asarray(lon, dtype="float64")
+    lat = np.asarray(lat, dtype="float64")
+    zone = (np.floor((lon + 180) / 6).astype("int64") % 60) + 1
+    return np.where(lat < 0, 32700, 32600) + zone
+
+
+def geodesic_offset(lon, lat, azimuth, distance):
+    """
+    Move points along the WGS84 ellipsoid without projecting them.
+
+    Solves the forward geodesic problem for all points in one call, so points
+    in every UTM zone and hemisphere are handled in a single pass.
+
+    Args:
+        lon (array-like): Longitudes in decimal degrees.
+        lat (array-like): Latitudes in decimal degrees.
+        azimuth (array-like): Direction of travel in degrees clockwise from north.
+        distance (array-like): Distance to travel in meters.
+
+    Returns:
+        tuple: (lon, lat) arrays of the displaced points, shaped like the inputs.
+    """
+    lon, lat, azimuth, distance = np.broadcast_arrays(
+        np.asarray(lon, dtype="float64"),
+        np.asarray(lat, dtype="float64"),
+        np.asarray(azimuth, dtype="float64"),
+        np.asarray(distance, dtype="float64"),
+    )
+    shape = lon.shape
+    new_lon, new_lat, _ = WGS84_GEOD.fwd(
+        lon.ravel(), lat.ravel(), azimuth.ravel(), distance.ravel()
+    )
+    return np.reshape(new_lon, shape), np.reshape(new_lat, shape)
+
+
+def sample_distances(u, radius, distribution="uniform", min_offset=0, sigma=None):
+    """
+    Map uniform [0, 1) draws to offset distances inside a circle.
+
+    Distributions:
+        uniform: uniform over the area of the circle (r = R * sqrt(u)).
+        linear: uniform in distance from the center, which clusters samples
+            near the center (the original behavior of the buffer pages).
+        annulus: uniform over the area between min_offset and R.
+        gaussian: circular 2-D Gaussian with the given sigma, truncated at R.
+
+    Args:
+        u (np.ndarray): Uniform draws in [0, 1).
+        radius (float): Radius of the circle in meters.
+        distribution (str): One of DISTRIBUTIONS.
+        min_offset (float): Minimum distance in meters for "annulus".
+        sigma (float, optional): Standard deviation in meters for "gaussian".
+            Defaults to half the radius.
+
+    Returns:
+        np.ndarray: Distances in meters, shaped like u.
+    """
+    if distribution == "uniform":
+        return radius * np.sqrt(u)
+    if distribution == "linear":
+        return radius * u
+    if distribution == "annulus":
+        if not 0 <= min_offset <= radius:
+            raise ValueError("Minimum offset must be between 0 and the buffer radius.")
+        return np.sqrt(min_offset**2 + u * (radius**2 - min_offset**2))
+    if distribution == "gaussian":
+        if sigma is None:
+            sigma = radius / 2
+        if sigma <= 0:
+            raise ValueError("Gaussian sigma must be positive.")
+        # Inverse CDF of a Rayleigh distribution truncated at the radius
+        tail = -np.expm1(-(radius**2) / (2 * sigma**2))
+        return sigma * np.sqrt(-2 * np.log1p(-u * tail))
+    raise ValueError(
+        f"Unknown distribution {distribution!r}, expected one of {DISTRIBUTIONS}"
+    )
+
+
+def check_displacement(lon, lat, new_lon, new_lat, radius, min_offset=0, rtol=1e-3):
+    """
+    Check in bulk that every displaced point stays within the buffer.
+
+    Displacements are measured as geodesic distances on WGS84, with a relative
+    tolerance for UTM scale distortion.
+
+    Args:
+        lon (array-like): Original longitudes, broadcastable to new_lon.
+        lat (array-like): Original latitudes, broadcastable to new_lat.
+        new_lon (array-like): Displaced longitudes.
+        new_lat (array-like): Displaced latitudes.
+        radius (float): Maximum displacement in meters.
+        min_offset (float): Minimum displacement in meters.
+        rtol (float): Relative tolerance on both bounds.
+
+    Returns:
+        np.ndarray: Boolean mask shaped like new_lon, True where the point is valid.
+    """
+    lon, lat, new_lon, new_lat = np.broadcast_arrays(
+        np.asarray(lon, dtype="float64"),
+        np.asarray(lat, dtype="float64"),
+        np.asarray(new_lon, dtype="float64"),
+        np.asarray(new_lat, dtype="float64"),
+    )
+    _, _, dist = WGS84_GEOD.inv(
+        lon.ravel(), lat.ravel(), new_lon.ravel(), new_lat.ravel()
+    )
+    dist = np.reshape(dist, lon.shape)
+    return (dist <= radius * (1 + rtol)) & (dist >= min_offset * (1 - rtol))
+
+
+def create_obfuscated_points(
+    lon,
+    lat,
+    radius,
+    no_samp=1,
+    crs="EPSG:4326",
+    method="utm",
+    seed=None,
+    start=0,
+    distribution="uniform",
+    min_offset=0,
+    sigma=None,
+    validate=False,
+):
+    """
+    Create a circle with the given radius in feet around each provided point,
+    where the point is randomly located inside the circle (not at the center),
+    and sample a specifed number of points within each circle.
+
+    With method="utm" points are grouped by UTM zone and each zone is projected
+    and sampled in a single array pass. With method="geodesic" all samples are
+    offset directly on the WGS84 ellipsoid in one call (requires lon/lat input).
+
+    Args:
+        lon (array-like): Longitudes of the plots.
+        lat (array-like): Latitudes of the plots.
+        radius (float): Radius of the circle in feet.
+        no_samp (int): Number of samples per plot.
+        crs (str): CRS of the input coordinates.
+        method (str): "utm" or "geodesic".
+        seed (int, optional): Seed for reproducible samples (see random_uniform).
+        start (int): Index of the first given plot within the whole input.
+        distribution (str): Offset distance distribution (see sample_distances).
+        min_offset (float): Minimum offset in feet for "annulus".
+        sigma (float, optional): Standard deviation in feet for "gaussian".
+        validate (bool): Check every displacement against the radius and raise
+            ValueError if any sample falls outside the buffer.
+
+    Returns:
+        tuple: (lon, lat) arrays of shape (n_plots, no_samp).
+    """
+    lon = np.asarray(lon, dtype="float64")
+    lat = np.asarray(lat, dtype="float64")
+    shape = (lon.shape[0], no_samp)
+
+    # Convert radius from feet to meters
+    radius_m = radius * 0.3048
+
+    # Randomize every sample's location within the circle at once
+    draws = random_uniform(shape[0], 2 * no_samp, seed=seed, start=start)
+    angle = draws[:, :no_samp] * 2 * np.pi
+    distance = sample_distances(
+        draws[:, no_samp:],
+        radius_m,
+        distribution=distribution,
+        min_offset=min_offset * 0.3048,
+        sigma=None if sigma is None else sigma * 0.3048,
+    )
+
+    if method == "geodesic":
+        # Offset on the ellipsoid, no projection needed
+        sample_lon, sample_lat = geodesic_offset(
+            lon[:, None], lat[:, None], np.degrees(angle), distance
+        )
+    else:
+        sample_lon, sample_lat = _utm_offset(lon, lat, angle, distance, crs)
+
+    if validate:
+        valid = check_displacement(
+            lon[:, None],
+            lat[:, None],
+            sample_lon,
+            sample_lat,
+            radius_m,
+            min_offset=min_offset * 0.3048 if distribution == "annulus" else 0,
+        )
+        if not valid.all():
+            raise ValueError(
+                f"{(~valid).sum()} of {valid.size} samples were displaced outside the buffer."
+            )
+    return sample_lon, sample_lat
+
+
+def _utm_offset(lon, lat, angle, distance, crs):
+    # Offset (n, k) angles/distances from n points in their local UTM zones
+    sample_lon = np.empty(angle.shape)
+    sample_lat = np.empty(angle.shape)
+
+    # Project each local UTM zone for accurate distance calculations
+    registry = get_transformer_registry()
+    zones = utm_epsg(lon, lat)
+    for zone in np.unique(zones):
+        mask = zones == zone
+        transformer_to_utm, transformer_to_latlon = registry.get(crs, f"EPSG:{zone}")
+        x, y = transformer_to_utm.transform(lon[mask], lat[mask])
+
+        # Calculate centers so that the points are inside the circles but not at the center
+        center_x = x[:, None] - distance[mask] * np.cos(angle[mask])
+        center_y = y[:, None] - distance[mask] * np.sin(angle[mask])
+
+        # Transform the samples back to the input CRS
+        sample_lon[mask], sample_lat[mask] = transformer_to_latlon.transform(
+            center_x, center_y
+        )
+    return sample_lon, sample_lat
+
+
+def create_obfuscated_circles(
+    lon,
+    lat,
+    radius,
+    crs="EPSG:4326",
+    method="utm",
+    seed=None,
+    start=0,
+    distribution="uniform",
+    min_offset=0,
+    sigma=None,
+    quad_segs=32,
+):
+    """
+    Create a circle polygon with the given radius in feet for each provided point,
+    where the point is randomly located inside the circle (not at the center).
+
+    Uses the same draws as create_obfuscated_points with no_samp=1, so with a
+    seed each circle is centered on the matching obfuscated point. With
+    method="utm" all projected centers of a zone are buffered in one shapely
+    call and the vertex arrays are projected back in bulk. With
+    method="geodesic" the vertices are geodesic offsets from each center.
+
+    Args:
+        lon (array-like): Longitudes of the plots.
+        lat (array-like): Latitudes of the plots.
+        radius (float): Radius of the circle in feet.
+        crs (str): CRS of the input coordinates.
+        method (str): "utm" or "geodesic".
+        seed (int, optional): Seed for reproducible circles (see random_uniform).
+        start (int): Index of the first given plot within the whole input.
+        distribution (str): Offset distance distribution (see sample_distances).
+        min_offset (float): Minimum offset in feet for "annulus".
+        sigma (float, optional): Standard deviation in feet for "gaussian".
+        quad_segs (int): Number of segments per quarter circle.
+
+    Returns:
+        np.ndarray: Shapely polygons in the input CRS, one per plot.
+    """
+    lon = np.asarray(lon, dtype="float64")
+    lat = np.asarray(lat, dtype="float64")
+
+    # Convert radius from feet to meters
+    radius_m = radius * 0.3048
+
+    draws = random_uniform(lon.shape[0], 2, seed=seed, start=start)
+    angle = draws[:, :1] * 2 * np.pi
+    distance = sample_distances(
+        draws[:, 1:],
+        radius_m,
+        distribution=distribution,
+        min_offset=min_offset * 0.3048,
+        sigma=None if sigma is None else sigma * 0.3048,
+    )
+
+    if method == "geodesic":
+        center_lon, center_lat = geodesic_offset(
+            lon[:, None], lat[:, None], np.degrees(angle), distance
+        )
+        azimuth = np.linspace(0, 360, 4 * quad_segs, endpoint=False)
+        ring_lon, ring_lat = geodesic_offset(
+            center_lon, center_lat, azimuth[None, :], radius_m
+        )
+        return shapely.polygons(np.stack([ring_lon, ring_lat], axis=-1))
+
+    circles = np.empty(lon.shape[0], dtype=object)
+
+    registry = get_transformer_registry()
+    zones = utm_epsg(lon, lat)
+    for zone in np.unique(zones):
+        mask = zones == zone
+        transformer_to_utm, transformer_to_latlon = registry.get(crs, f"EPSG:{zone}")
+        x, y = transformer_to_utm.transform(lon[mask], lat[mask])
+
+        center_x = x - distance[mask, 0] * np.cos(angle[mask, 0])
+        center_y = y - distance[mask, 0] * np.sin(angle[mask, 0])
+        zone_circles = shapely.buffer(
+            shapely.points(center_x, center_y), radius_m, quad_segs=quad_segs
+        )
+
+        # Project every vertex of the zone back in a single transform
+        circles[mask] = shapely.transform(
+            zone_circles,
+            lambda coords: np.column_stack(
+                transformer_to_latlon.transform(coords[:, 0], coords[:, 1])
+            ),
+        )
+    return circles
+
+
+def _obfuscate_chunk(lon, lat, start, **kwargs):
+    # Module level so it can be pickled into worker processes. Also returns the
+    # transformer lookups of the chunk, which a pool reports to the parent.
+    registry = get_transformer_registry()
+    before = registry.stats()
+    result = create_obfuscated_points(lon, lat, start=start, **kwargs)
+    after = registry.stats()
+    lookups = (after["hits"] - before["hits"], after["misses"] - before["misses"])
+    return start, result, lookups
+
+
+def obfuscate_in_chunks(
+    lon,
+    lat,
+    radius,
+    no_samp=1,
+    method="utm",
+    seed=None,
+    workers=1,
+    chunk_size=None,
+    progress=None,
+    **sampling,
+):
+    """
+    Run create_obfuscated_points over row chunks, optionally in a process pool.
+
+    Chunks are aligned to RNG_BLOCK_SIZE and results are written back in input
+    order, so with a seed the output does not depend on the number of workers.
+
+    Args:
+        lon (array-like): Longitudes of the plots.
+        lat (array-like): Latitudes of the plots.
+        radius (float): Radius of the circle in feet.
+        no_samp (int): Number of samples per plot.
+        method (str): "utm" or "geodesic".
+        seed (int, optional): Seed for reproducible samples.
+        workers (int): Number of worker processes. 1 runs in this process.
+        chunk_size (int, optional): Plots per chunk. Defaults to about
+            CHUNK_POINTS output points per chunk, or fewer so that there are at
+            least four chunks per worker, rounded up to RNG_BLOCK_SIZE.
+        progress (callable, optional): Called with the finished fraction (0-1)
+            each time a chunk completes.
+        **sampling: distribution, min_offset, sigma and validate, passed to
+            create_obfuscated_points.
+
+    Returns:
+        tuple: (lon, lat) arrays of shape (n_plots, no_samp).
+    """
+    lon = np.asarray(lon, dtype="float64")
+    lat = np.asarray(lat, dtype="float64")
+    n = lon.shape[0]
+    if chunk_size is None:
+        # About CHUNK_POINTS output points per chunk, but small enough that
+        # every worker gets several chunks and progress updates keep coming
+        blocks = min(
+            max(1, CHUNK_POINTS // max(no_samp, 1) // RNG_BLOCK_SIZE),
+            max(1, -(-n // (max(workers, 1) * 4 * RNG_BLOCK_SIZE))),
+        )
+        chunk_size = blocks * RNG_BLOCK_SIZE
+    starts = range(0, n, chunk_size)
+    kernel = partial(
+        _obfuscate_chunk,
+        radius=radius,
+        no_samp=no_samp,
+        method=method,
+        seed=seed,
+        **sampling,
+    )
+
+    sample_lon = np.empty((n, no_samp))
+    sample_lat = np.empty((n, no_samp))
+
+    def store(result, done):
+        start, (chunk_lon, chunk_lat), _ = result
+        sample_lon[start : start + chunk_size] = chunk_lon
+        sample_lat[start : start + chunk_size] = chunk_lat
+        if progress is not None:
+            progress(done / len(starts))
+
+    workers = min(workers, len(starts), os.cpu_count() or 1)
+    if workers <= 1:
+        for done, start in enumerate(starts, 1):
+            store(
+                kernel(
+                    lon[start : start + chunk_size],
+                    lat[start : start + chunk_size],
+                    start,
+                ),
+                done,
+            )
+    else:
+        # spawn avoids forking the threaded Streamlit server
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=get_context("spawn")
+        ) as pool:
+            futures = [
+                pool.submit(
+                    kernel,
+                    lon[start : start + chunk_size],
+                    lat[start : start + chunk_size],
+                    start,
+                )
+                for start in starts
+            ]
+            registry = get_transformer_registry()
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                registry.add_worker_counts(*result[2])
+                store(result, done)
+    return sample_lon, sample_lat
+
+
+def stream_obfuscated_csv(
+    source,
+    out,
+    radius,
+    no_samp=1,
+    method="utm",
+    seed=None,
+    chunk_rows=None,
+    progress=None,
+    check=None,
+    **sampling,
+):
+    """
+    Obfuscate a CSV of plots chunk by chunk, appending the samples to out.
+
+    Only one chunk of input and output is held in memory at a time, so memory
+    use does not grow with the size of the file. Rows are read with
+    utils.ingest.iter_csv_points and seeded by their position among the rows
+    kept, so the output matches obfuscate_in_chunks on the same rows.
+
+    Args:
+        source (str, file-like): CSV with the plot coordinates.
+        out (file-like): Binary file to append the CSV output to, e.g. a
+            tempfile.SpooledTemporaryFile.
+        radius (float): Radius of the circle in feet.
+        no_samp (int): Number of samples per plot.
+        method (str): "utm" or "geodesic".
+        seed (int, optional): Seed for reproducible samples.
+        chunk_rows (int, optional): Plots read per chunk.
+        progress (callable, optional): Called with the number of plots done
+            after each chunk.
+        check (callable, optional): Called with each chunk before it is
+            obfuscated; the rows of the frame it returns are left out, e.g.
+            a utils.ingest.ChunkValidator.
+        **sampling: distribution, min_offset, sigma and validate, passed to
+            create_obfuscated_points.
+
+    Returns:
+        int: Number of plots processed.
+    """
+    if chunk_rows is None:
+        chunk_rows = (
+            max(1, CHUNK_POINTS // max(no_samp, 1) // RNG_BLOCK_SIZE) * RNG_BLOCK_SIZE
+        )
+    start = 0
+    for chunk in iter_csv_points(source, chunk_rows):
+        if check is not None:
+            chunk = chunk.drop(index=check(chunk).index)
+        if chunk.empty:
+            continue
+        sample_lon, sample_lat = create_obfuscated_points(
+            chunk.LON,
+            chunk.LAT,
+            radius,
+            no_samp,
+            method=method,
+            seed=seed,
+            start=start,
+            **sampling,
+        )
+        # Continue the row index across chunks, as a single to_csv would
+        df = pd.DataFrame(
+            {
+                "plot_ID": np.repeat(chunk["plot_ID"].to_numpy(), no_samp),
+                "lat": sample_lat.ravel(),
+                "lon": sample_lon.ravel(),
+            },
+            index=pd.RangeIndex(start * no_samp, (start + len(chunk)) * no_samp),
+        )
+        df.to_csv(out, header=start == 0)
+        start += len(chunk)
+        if progress is not None:
+            progress(start)
+    return start
@@ -0,0 +1,211 @@
+import datetime
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import streamlit as st
+
+from utils.catalog import CACHE_DIR
+
+# Coordinates are matched after rounding to this many decimal degrees (about 0.1 m)
+COORDINATE_DECIMALS = 6
+
+# Seconds a stored value is trusted before it is sampled again, in case the
+# asset was re-published under the same ID
+RESULT_TTL = 30 * 24 * 60 * 60
+
+# Date windows that may still gain scenes are trusted for much less
+OPEN_WINDOW_TTL = 60 * 60
+
+# Scenes can reach Earth Engine days after they were acquired, so a window is
+# treated as open until this long after its end date
+INGEST_LAG = datetime.timedelta(days=7)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    dataset TEXT NOT NULL,
+    date_window TEXT NOT NULL,
+    method TEXT NOT NULL,
+    lat INTEGER NOT NULL,
+    lon INTEGER NOT NULL,
+    bands_json TEXT,
+    checked_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (dataset, date_window, method, lat, lon)
+) WITHOUT ROWID
+"""
+
+
+def date_window(start_date, end_date):
+    """
+    The date window part of a store key.
+
+    Args:
+        start_date (str or datetime.date): Start of the window.
+        end_date (str or datetime.date): End of the window.
+
+    Returns:
+        str: "start|end".
+    """
+    return f"{start_date}|{end_date}"
+
+
+def window_is_open(window, today=None):
+    """
+    Whether images in a date window may still change as new scenes arrive.
+
+    Args:
+        window (str): As returned by date_window.
+        today (datetime.date, optional): Defaults to the current UTC date.
+
+    Returns:
+        bool: True unless the window ended more than INGEST_LAG ago; also
+            True when its end date cannot be read.
+    """
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    try:
+        end = datetime.date.fromisoformat(window.rsplit("|", 1)[1])
+    except (IndexError, ValueError):
+        return True
+    return end + INGEST_LAG > today
+
+
+def coordinate_keys(lon, lat, decimals=COORDINATE_DECIMALS):
+    """
+    Integer keys of rounded coordinates.
+
+    Args:
+        lon (array-like): Longitudes in WGS84.
+        lat (array-like): Latitudes in WGS84.
+        decimals (int): Decimal degrees kept.
+
+    Returns:
+        tuple: (lon_keys, lat_keys) int64 arrays.
+    """
+    factor = 10**decimals
+    return (
+        np.round(np.asarray(lon, dtype="float64") * factor).astype("int64"),
+        np.round(np.asarray(lat, dtype="float64") * factor).astype("int64"),
+    )
+
+
+class ResultStore:
+    """
+    Sampled band values per dataset and coordinate, kept in SQLite across sessions.
+
+    Rows are keyed by dataset ID, date window, compositing method and rounded
+    coordinate. Points that fell on masked pixels are stored too, with no
+    values, so they are not requested again. Rows expire after the TTL, or
+    OPEN_WINDOW_TTL when their date window may still gain scenes (see
+    window_is_open). Every call opens its own connection, so the store can
+    be used from any thread or process.
+    """
+
+    def __init__(
+        self,
+        path=os.path.join(CACHE_DIR, "results.sqlite"),
+        ttl=RESULT_TTL,
+        open_ttl=OPEN_WINDOW_TTL,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.open_ttl = open_ttl
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(_SCHEMA)
+            columns = [row[1] for row in con.execute("PRAGMA table_info(results)")]
+            if "checked_at" not in columns:
+                # Stores written before rows were timestamped; their rows count as expired
+                con.execute(
+                    "ALTER TABLE results ADD COLUMN checked_at REAL NOT NULL DEFAULT 0"
+                )
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call; committed on success and always closed
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def lookup(self, key, lon, lat):
+        """
+        Find unexpired stored results for a set of coordinates.
+
+        Args:
+            key (tuple): (dataset, date_window, method), with date_window as
+                returned by date_window.
+            lon (array-like): Longitudes in WGS84.
+            lat (array-like): Latitudes in WGS84.
+
+        Returns:
+            dict: Position of every coordinate found -> dict of band values,
+                or None when its pixel was masked.
+        """
+        lon_keys, lat_keys = coordinate_keys(lon, lat)
+        ttl = self.open_ttl if window_is_open(key[1]) else self.ttl
+        with self._connect() as con:
+            # The temporary table lets SQLite match every coordinate in one join.
+            # CROSS JOIN keeps the query table as the outer loop, so each
+            # coordinate is a primary key lookup rather than a scan of the dataset.
+            con.execute(
+                "CREATE TEMP TABLE query (pos INTEGER PRIMARY KEY, lat INTEGER, lon INTEGER)"
+            )
+            con.executemany(
+                "INSERT INTO query VALUES (?, ?, ?)",
+                zip(range(len(lon_keys)), lat_keys.tolist(), lon_keys.tolist()),
+            )
+            rows = con.execute(
+                "SELECT q.pos, r.bands_json FROM query q CROSS JOIN results r"
+                " ON r.dataset = ? AND r.date_window = ? AND r.method = ? AND r.lat = q.lat AND r.lon = q.lon"
+                " WHERE r.checked_at >= ?",
+                (*key, time.time() - ttl),
+            ).fetchall()
+        return {
+            pos: json.loads(bands) if bands is not None else None for pos, bands in rows
+        }
+
+    def store(self, key, lon, lat, values):
+        """
+        Save the results of newly sampled coordinates.
+
+        Args:
+            key (tuple): (dataset, date_window, method).
+            lon (array-like): Longitudes in WGS84.
+            lat (array-like): Latitudes in WGS84.
+            values (list): Dict of band values for each coordinate, or None
+                where its pixel was masked.
+        """
+        lon_keys, lat_keys = coordinate_keys(lon, lat)
+        now = time.time()
+        rows = (
+            (*key, la, lo, json.dumps(v) if v is not None else None, now)
+            for la, lo, v in zip(lat_keys.tolist(), lon_keys.tolist(), values)
+        )
+        with self._connect() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO results"
+                " (dataset, date_window, method, lat, lon, bands_json, checked_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def stats(self):
+        """Return the number of stored coordinates per dataset."""
+        with self._connect() as con:
+            return dict(
+                con.execute(
+                    "SELECT dataset, COUNT(*) FROM results GROUP BY dataset"
+                ).fetchall()
+            )
+
+
+@st.cache_resource
+def get_result_store():
+    """Shared ResultStore, reused across reruns and sessions."""
+    return ResultStore()
@@ -0,0 +1,275 @@
+import random
+import re
+import threading
+import time
+from functools import wraps
+
+import requests
+import streamlit as st
+
+# Requests started per second across the process, and how many may start at once
+REQUEST_RATE = 10.0
+REQUEST_BURST = 10
+
+# Bounds and starting point of the adaptive concurrency limit
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 8
+INITIAL_CONCURRENCY = 4
+
+# Latency tracking: a request kind is slow when the moving average of its
+# latency exceeds LATENCY_TOLERANCE times its baseline, the lowest average
+# seen. The baseline creeps up towards the average so that a lasting change,
+# e.g. larger batches, stops counting as slow.
+LATENCY_SMOOTHING = 0.2
+LATENCY_TOLERANCE = 2.0
+BASELINE_DRIFT = 0.01
+# Requests of a kind needed before its baseline is trusted
+LATENCY_WARMUP = 5
+
+# Retries of idempotent calls, with full-jitter exponential backoff in seconds
+MAX_RETRIES = 5
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+
+# HTTP statuses that mean "slow down" or "try again"
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Status lines of those responses, for errors that only pass on the message
+RETRYABLE_STATUS_LINES = re.compile(
+    r"\b(?:429 too many requests|500 internal server error|502 bad gateway"
+    r"|503 service unavailable|504 gateway timeout|http error (?:429|50[0234]))\b"
+)
+# Earth Engine's throttling messages, which carry no status
+RETRYABLE_MARKERS = (
+    "too many requests",
+    "too many concurrent",
+    "rate limit",
+    "quota exceeded",
+)
+# Failures a retry would only repeat, e.g. an interactive computation over its time limit
+FINAL_MARKERS = ("computation timed out", "memory limit exceeded")
+# Failures of the connection rather than of the request
+TRANSPORT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    requests.ConnectionError,
+    requests.Timeout,
+)
+
+
+def is_retryable(error):
+    """
+    Whether an error is a throttle or a transient server failure.
+
+    The status of an HTTP error is read from the error or the error it was
+    raised from, e.g. the googleapiclient HttpError behind an EEException.
+    Messages are only matched for Earth Engine's throttling phrases and
+    full HTTP status lines, and computation timeouts are always final.
+
+    Args:
+        error (Exception): The error raised by an Earth Engine call.
+
+    Returns:
+        bool: True for connection errors, 429s and 5xx responses.
+    """
+    message = str(error).lower()
+    if any(marker in message for marker in FINAL_MARKERS):
+        return False
+    cause = error
+    while cause is not None:
+        if isinstance(cause, TRANSPORT_ERRORS):
+            return True
+        status = _status_code(cause)
+        if status is not None:
+            return status in RETRYABLE_STATUSES
+        cause = cause.__cause__ or cause.__context__
+    return bool(RETRYABLE_STATUS_LINES.search(message)) or any(
+        marker in message for marker in RETRYABLE_MARKERS
+    )
+
+
+def _status_code(error):
+    # googleapiclient's HttpError keeps the response in resp, requests' HTTPError in response
+    for name in ("resp", "response"):
+        response = getattr(error, name, None)
+        if response is None:
+            continue
+        for attribute in ("status", "status_code"):
+            status = getattr(response, attribute, None)
+            if status is not None:
+                try:
+                    return int(status)
+                except (TypeError, ValueError):
+                    return None
+    return None
+
+
+class RequestScheduler:
+    """
+    Gate for Earth Engine requests with rate limiting, adaptive concurrency and retries.
+
+    Every request takes a token from a bucket refilled at REQUEST_RATE per
+    second and a slot under the concurrency limit. The limit grows by about
+    one per limit's worth of successful requests and halves on a throttle or
+    transient failure (AIMD), or shrinks slightly when requests slow down:
+    when a request takes longer than latency_target, or without a target,
+    when the moving average latency of its kind of call (the function called)
+    exceeds LATENCY_TOLERANCE times its baseline. Only requests started after
+    the last decrease can trigger another, so one burst of failures halves
+    the limit once. Idempotent calls that fail with a retryable error are
+    retried after a full-jitter exponential backoff; other errors are raised
+    at once.
+    """
+
+    def __init__(
+        self,
+        rate=REQUEST_RATE,
+        burst=REQUEST_BURST,
+        min_concurrency=MIN_CONCURRENCY,
+        max_concurrency=MAX_CONCURRENCY,
+        initial_concurrency=INITIAL_CONCURRENCY,
+        max_retries=MAX_RETRIES,
+        base_delay=BASE_DELAY,
+        max_delay=MAX_DELAY,
+        latency_target=None,
+        latency_tolerance=LATENCY_TOLERANCE,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency_target = latency_target
+        self.latency_tolerance = latency_tolerance
+        # Request kind -> (moving average latency, baseline, requests seen)
+        self._latency = {}
+        self._condition = threading.Condition()
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._decreased_at = float("-inf")
+        self.limit = float(initial_concurrency)
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.slowed = 0
+        self.failures = 0
+
+    def call(self, fn, *args, idempotent=True, **kwargs):
+        """
+        Run fn(*args, **kwargs) as a scheduled request.
+
+        Args:
+            fn (callable): The Earth Engine call.
+            idempotent (bool): Whether fn may safely be repeated after a failure.
+
+        Returns:
+            The return value of fn.
+        """
+        kind = getattr(fn, "__qualname__", None) or repr(fn)
+        for attempt in range(self.max_retries + 1):
+            start = self._acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as error:
+                retryable = is_retryable(error)
+                self._release(start, kind, congested=retryable)
+                if not (idempotent and retryable) or attempt == self.max_retries:
+                    with self._condition:
+                        self.failures += 1
+                    raise
+                with self._condition:
+                    self.retries += 1
+                time.sleep(
+                    random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+                )
+            else:
+                self._release(start, kind, congested=False)
+                return result
+
+    def stats(self):
+        """Return request, retry, throttle and slowdown counts and the current concurrency limit."""
+        with self._condition:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "slowed": self.slowed,
+                "failures": self.failures,
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+            }
+
+    def _acquire(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._refilled_at) * self.rate
+                )
+                self._refilled_at = now
+                if self.in_flight < int(self.limit) and self._tokens >= 1:
+                    self._tokens -= 1
+                    self.in_flight += 1
+                    self.requests += 1
+                    return now
+                # Wake up when the next token is due, or earlier if a slot frees up
+                self._condition.wait(timeout=max((1 - self._tokens) / self.rate, 0.01))
+
+    def _is_slow(self, kind, latency):
+        # Called with the condition held, for requests that succeeded
+        if self.latency_target is not None:
+            return latency > self.latency_target
+        average, baseline, seen = self._latency.get(kind, (latency, latency, 0))
+        average += LATENCY_SMOOTHING * (latency - average)
+        baseline = min(average, baseline + BASELINE_DRIFT * (average - baseline))
+        self._latency[kind] = (average, baseline, seen + 1)
+        return seen >= LATENCY_WARMUP and average > self.latency_tolerance * baseline
+
+    def _release(self, start, kind, congested):
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            slow = not congested and self._is_slow(kind, now - start)
+            if congested or slow:
+                if congested:
+                    self.throttled += 1
+                else:
+                    self.slowed += 1
+                # Requests already in flight at the last decrease saw the old limit
+                if start > self._decreased_at:
+                    factor = 0.5 if congested else 0.9
+                    self.limit = max(self.min_concurrency, self.limit * factor)
+                    self._decreased_at = now
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+def scheduled(fn, scheduler=None, idempotent=True):
+    """
+    Wrap a function so every call goes through a RequestScheduler.
+
+    Args:
+        fn (callable): The Earth Engine call to wrap.
+        scheduler (RequestScheduler, optional): Defaults to the shared scheduler.
+        idempotent (bool): Whether failed calls may be retried.
+
+    Returns:
+        callable: fn, scheduled.
+    """
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return (scheduler or get_scheduler()).call(
+            fn, *args, idempotent=idempotent, **kwargs
+        )
+
+    return wrapper
+
+
+@st.cache_resource
+def get_scheduler():
+    """Shared RequestScheduler, so all sessions stay under one request budget."""
+    return RequestScheduler()
@@ -0,0 +1,79 @@
+import threading
+
+import streamlit as st
+from pyproj import Transformer
+
+
+class TransformerRegistry:
+    """
+    Process-wide store of prebuilt pyproj transformers.
+
+    Forward (source -> UTM) and inverse (UTM -> source) transformers are built
+    once per (source CRS, UTM CRS) pair and handed out to every later caller.
+    pyproj transformers are thread-safe, so the same pair is shared by all
+    sessions; the lock only guards the dictionary and the counters. Worker
+    processes have registries of their own; their counts are added to the
+    worker_hits and worker_misses of the parent's registry (see add_worker_counts).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._transformers = {}
+        self.hits = 0
+        self.misses = 0
+        self.worker_hits = 0
+        self.worker_misses = 0
+
+    def get(self, src_crs, utm_crs):
+        """
+        Get the forward and inverse transformers for a CRS pair.
+
+        Args:
+            src_crs (str, pyproj.CRS): CRS of the input coordinates.
+            utm_crs (str, pyproj.CRS): Projected CRS to work in.
+
+        Returns:
+            tuple: (to_utm, to_src) pyproj Transformers, both using always_xy.
+        """
+        key = (str(src_crs), str(utm_crs))
+        with self._lock:
+            pair = self._transformers.get(key)
+            if pair is not None:
+                self.hits += 1
+                return pair
+            self.misses += 1
+            pair = (
+                Transformer.from_crs(src_crs, utm_crs, always_xy=True),
+                Transformer.from_crs(utm_crs, src_crs, always_xy=True),
+            )
+            self._transformers[key] = pair
+            return pair
+
+    def add_worker_counts(self, hits, misses):
+        """
+        Record lookups made by a worker process's own registry.
+
+        Args:
+            hits (int): Lookups served from the worker's registry.
+            misses (int): Transformer pairs the worker had to build.
+        """
+        with self._lock:
+            self.worker_hits += hits
+            self.worker_misses += misses
+
+    def stats(self):
+        """Return hit/miss counts of this process and its workers and number of cached CRS pairs."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "worker_hits": self.worker_hits,
+                "worker_misses": self.worker_misses,
+                "pairs": len(self._transformers),
+            }
+
+
+@st.cache_resource
+def get_transformer_registry():
+    """Shared TransformerRegistry, reused across reruns and sessions."""
+    return TransformerRegistry()